@@ -1,6 +1,16 @@
+import time
+BOOT_TIME = time.monotonic()
+
 import logging
 import sqlite3
 import asyncio
+import threading
+import functools
+import contextlib
+import itertools
+import gzip
+import traceback
+from collections import deque
 import urllib.parse
 from dotenv import load_dotenv
 import os
@@ -19,15 +29,23 @@ from telegram.ext import (
     MessageHandler,
     filters,
     CallbackContext,
-    PreCheckoutQueryHandler
+    PreCheckoutQueryHandler,
+    TypeHandler
 )
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException, WebDriverException
-import time
+from telegram.error import BadRequest, RetryAfter
+
+# Selenium импортируется лениво (см. load_selenium), чтобы не замедлять запуск бота
+webdriver = None
+By = None
+Keys = None
+Service = None
+WebDriverWait = None
+EC = None
+TimeoutException = None
+NoSuchElementException = None
+WebDriverException = None
+WebElement = None
+_selenium_lock = threading.Lock()
 
 # Настройки логирования
 logging.basicConfig(
@@ -47,6 +65,116 @@ CHROME_DRIVER_PATH = os.getenv('CHROME_DRIVER_PATH')
 ACCOUNT_EMAIL = os.getenv('ACCOUNT_EMAIL')
 ACCOUNT_PASSWORD = os.getenv('ACCOUNT_PASSWORD')
 
+# Прогрев браузера при запуске: авторизованная сессия готовится в фоне
+PREWARM_BROWSER = os.getenv('PREWARM_BROWSER', '0') == '1'
+
+# Реестр браузерных сессий: каждый запущенный ботом Chrome учитывается здесь
+BROWSER_IDLE_TIMEOUT = int(os.getenv('BROWSER_IDLE_TIMEOUT', '600'))  # сек простоя до закрытия
+BROWSER_MAX_LIFETIME = int(os.getenv('BROWSER_MAX_LIFETIME', '1800'))  # сек жизни занятой сессии
+# Занятая сессия старше BROWSER_MAX_LIFETIME закрывается, только если столько сек не продвигается
+BROWSER_STALL_TIMEOUT = int(os.getenv('BROWSER_STALL_TIMEOUT', '600'))
+BROWSER_MEMORY_LIMIT_MB = int(os.getenv('BROWSER_MEMORY_LIMIT_MB', '2048'))
+BROWSER_REAPER_INTERVAL = int(os.getenv('BROWSER_REAPER_INTERVAL', '60'))
+BROWSER_ORPHAN_GRACE = 60  # сек: только что запущенный Chrome еще может регистрироваться
+BROWSER_IDLE_TIMEOUTS = {
+    'password_change': 300
+}
+BROWSER_SESSIONS = {}
+_browser_sessions_lock = threading.Lock()
+_browser_session_ids = itertools.count(1)
+_background_tasks = set()
+
+# Версия схемы базы данных (хранится в PRAGMA user_version)
+SCHEMA_VERSION = 3
+
+# Хранение истории запросов: старые записи уходят в сжатый помесячный архив
+REQUESTS_RETENTION_DAYS = int(os.getenv('REQUESTS_RETENTION_DAYS', '90'))
+REQUESTS_ARCHIVE_DIR = os.getenv('REQUESTS_ARCHIVE_DIR', 'archive')
+ARCHIVE_PENDING_FILE = 'pending.jsonl'  # пачка, удаление которой еще не подтверждено
+RETENTION_INTERVAL = int(os.getenv('RETENTION_INTERVAL', '3600'))
+RETENTION_BATCH_SIZE = 500
+RETENTION_BATCH_PAUSE = 0.1  # сек между пачками, чтобы не держать блокировку базы
+VACUUM_PAGES_PER_STEP = 200
+
+# Пакетная обработка: несколько видео в одной браузерной сессии
+BATCH_MAX_JOBS = int(os.getenv('BATCH_MAX_JOBS', '20'))
+BATCH_MAX_FILE_SIZE = 64 * 1024
+
+# Сообщение о ходе задачи редактируется на месте, не чаще раза в интервал
+PROGRESS_MIN_EDIT_INTERVAL = float(os.getenv('PROGRESS_MIN_EDIT_INTERVAL', '3'))
+PROGRESS_STAGES = {
+    'queued': "⏳ Задача в очереди...",
+    'login': "🔐 Вход в аккаунт videohunt.ai...",
+    'analyzing': "🔄 Анализирую видео, пожалуйста подождите...",
+}
+
+# Мониторинг цикла событий: лаг, блокирующие вызовы и время обработчиков
+LOOP_MONITOR_ENABLED = os.getenv('LOOP_MONITOR', '0') == '1'
+LOOP_MONITOR_INTERVAL = 0.1  # сек между замерами лага
+LOOP_BLOCK_THRESHOLD = float(os.getenv('LOOP_BLOCK_THRESHOLD', '0.5'))  # сек блокировки, после которых пишем стек
+
+# Адаптивные таймауты этапов Selenium: p99 успешных ожиданий × запас.
+# default - пока замеров мало (прежние фиксированные значения)
+STAGE_TIMEOUTS = {
+    'login_fields': {'default': 15, 'floor': 5, 'ceiling': 30},
+    'login_redirect': {'default': 30, 'floor': 10, 'ceiling': 60},
+    'page_load': {'default': 30, 'floor': 10, 'ceiling': 60},
+    'results': {'default': 120, 'floor': 30, 'ceiling': 240},
+}
+STAGE_TIMEOUT_FACTOR = float(os.getenv('STAGE_TIMEOUT_FACTOR', '2'))
+STAGE_TIMING_WINDOW = 200  # сколько последних замеров учитывается
+STAGE_TIMING_MIN_SAMPLES = 20
+STAGE_TIMINGS = {}
+_stage_timings_pending = []  # замеры, еще не сохраненные в базу
+_stage_timings_lock = threading.Lock()
+
+# Автоматический выключатель: при массовых сбоях videohunt.ai задачи отклоняются сразу
+BREAKER_WINDOW = int(os.getenv('BREAKER_WINDOW', '300'))  # сек скользящего окна
+BREAKER_MIN_FAILURES = int(os.getenv('BREAKER_MIN_FAILURES', '5'))
+BREAKER_FAILURE_RATE = float(os.getenv('BREAKER_FAILURE_RATE', '0.5'))
+BREAKER_OPEN_SECONDS = int(os.getenv('BREAKER_OPEN_SECONDS', '120'))
+BREAKER_HALF_OPEN_PROBES = 1  # одновременных пробных задач
+BREAKER_PROBES_TO_CLOSE = 2
+BREAKER_STATE_NAMES = {
+    'closed': "✅ закрыт (сервис работает)",
+    'open': "⛔ открыт (задачи отклоняются)",
+    'half_open': "🟡 полуоткрыт (пробные задачи)",
+}
+
+# Очередь задач анализа: общее число браузеров и резерв для премиум-подписчиков
+MAX_CONCURRENT_BROWSERS = int(os.getenv('MAX_CONCURRENT_BROWSERS', '3'))
+PREMIUM_RESERVED_SLOTS = int(os.getenv('PREMIUM_RESERVED_SLOTS', '1'))
+QUEUE_AGING_SECONDS = int(os.getenv('QUEUE_AGING_SECONDS', '120'))  # после стольких секунд ожидания бесплатная задача встает в очередь наравне с премиум
+
+# Режим браузеров: 'process' - свой Chrome на задачу, 'tabs' - несколько задач
+# во вкладках одного авторизованного Chrome
+BROWSER_MODE = os.getenv('BROWSER_MODE', 'process')
+TABS_PER_BROWSER = int(os.getenv('TABS_PER_BROWSER', '4'))
+MAX_CONCURRENT_JOBS = MAX_CONCURRENT_BROWSERS * (TABS_PER_BROWSER if BROWSER_MODE == 'tabs' else 1)
+_shared_browsers_lock = threading.Lock()
+
+# Предзагрузка страницы видео, пока пользователь пишет промт
+SPECULATIVE_PRELOAD = os.getenv('SPECULATIVE_PRELOAD', '1') == '1'
+SPECULATION_TIMEOUT = int(os.getenv('SPECULATION_TIMEOUT', '90'))  # сек ожидания промта
+SPECULATIONS = {}
+SPECULATION_STATS = {
+    'started': 0,
+    'hits': 0,
+    'expired': 0,
+    'preempted': 0,
+    'cancelled': 0,
+    'failed': 0,
+    'wasted_seconds': 0.0,
+    'saved_seconds': 0.0
+}
+
+# Сколько промтов можно задать к одному видео за раз
+MAX_PROMPTS_PER_VIDEO = int(os.getenv('MAX_PROMPTS_PER_VIDEO', '5'))
+
+# Метрики запуска: секунды с момента старта процесса
+STARTUP_METRICS = {}
+_first_updates = {}  # update_id -> время начала обработки, пока нет метрики first_response
+
 login_page = "https://videohunt.ai/login"
 SUBSCRIPTION_TYPES = {
     'free': {
@@ -67,58 +195,109 @@ def init_db():
     conn = sqlite3.connect(DB_NAME)
     cursor = conn.cursor()
     
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        user_id INTEGER PRIMARY KEY,
-        username TEXT,
-        first_name TEXT,
-        last_name TEXT,
-        registration_date TEXT,
-        is_admin INTEGER DEFAULT 0
-    )
-    ''')
+    # Схема уже актуальна - пропускаем DDL
+    cursor.execute('PRAGMA user_version')
+    version = cursor.fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        conn.close()
+        load_settings_to_subscription_types()
+        return
     
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS subscriptions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        subscription_type TEXT,
-        start_date TEXT,
-        end_date TEXT,
-        FOREIGN KEY (user_id) REFERENCES users (user_id)
-    )
-    ''')
+    if version < 1:
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            registration_date TEXT,
+            is_admin INTEGER DEFAULT 0
+        )
+        ''')
     
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS requests (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        request_date TEXT,
-        request_type TEXT,
-        FOREIGN KEY (user_id) REFERENCES users (user_id)
-    )
-    ''')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            subscription_type TEXT,
+            start_date TEXT,
+            end_date TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''')
     
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS settings (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        free_daily_requests INTEGER DEFAULT 5,
-        premium_daily_requests INTEGER DEFAULT 15,
-        subscription_price INTEGER DEFAULT 100
-    )
-    ''')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            request_date TEXT,
+            request_type TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''')
     
-    cursor.execute('SELECT COUNT(*) FROM settings')
-    if cursor.fetchone()[0] == 0:
         cursor.execute('''
-        INSERT INTO settings (
-            free_daily_requests, 
-            premium_daily_requests, 
-            subscription_price
-        ) VALUES (?, ?, ?)
-        ''', (5, 15, 100))
+        CREATE TABLE IF NOT EXISTS settings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            free_daily_requests INTEGER DEFAULT 5,
+            premium_daily_requests INTEGER DEFAULT 15,
+            subscription_price INTEGER DEFAULT 100
+        )
+        ''')
+    
+        cursor.execute('SELECT COUNT(*) FROM settings')
+        if cursor.fetchone()[0] == 0:
+            cursor.execute('''
+            INSERT INTO settings (
+                free_daily_requests, 
+                premium_daily_requests, 
+                subscription_price
+            ) VALUES (?, ?, ?)
+            ''', (5, 15, 100))
+    
+    if version < 2:
+        # Инкрементальный VACUUM: место после очистки старых запросов возвращается по частям
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_requests_date ON requests (request_date)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_requests_user_date ON requests (user_id, request_date)')
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS requests_archive (
+            month TEXT,
+            request_type TEXT,
+            requests INTEGER DEFAULT 0,
+            PRIMARY KEY (month, request_type)
+        )
+        ''')
+    
+    if version < 3:
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stage_timings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            stage TEXT,
+            duration REAL,
+            recorded_at TEXT
+        )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_stage_timings_stage ON stage_timings (stage, id)')
     
     conn.commit()
+    
+    # Для уже существующей базы auto_vacuum включается только после полного VACUUM.
+    # Версия схемы записывается после него: если VACUUM не удался, миграция
+    # повторится при следующем запуске (все шаги выше идемпотентны)
+    cursor.execute('PRAGMA auto_vacuum')
+    if cursor.fetchone()[0] != 2:
+        logger.info("Включаю инкрементальный VACUUM, это может занять время...")
+        try:
+            cursor.execute('VACUUM')
+        except sqlite3.Error as e:
+            logger.error(f"Не удалось выполнить VACUUM, повторю при следующем запуске: {str(e)}")
+            conn.close()
+            load_settings_to_subscription_types()
+            return
+    
+    cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    conn.commit()
     conn.close()
     
     load_settings_to_subscription_types()
@@ -183,21 +362,72 @@ def get_user_subscription(user_id):
         }
     return None
 
+def get_user_tier(user_id):
+    """Тариф пользователя для очереди задач: 'premium' или 'free'"""
+    subscription = get_user_subscription(user_id)
+    return subscription['type'] if subscription else 'free'
+
 def get_today_requests_count(user_id):
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    today = datetime.now().date().isoformat()
+    # Диапазон вместо date(request_date), чтобы работал индекс (user_id, request_date)
+    today = datetime.now().date()
     cursor.execute('''
     SELECT COUNT(*) 
     FROM requests 
-    WHERE user_id = ? AND date(request_date) = ?
-    ''', (user_id, today))
+    WHERE user_id = ? AND request_date >= ? AND request_date < ?
+    ''', (user_id, today.isoformat(), (today + timedelta(days=1)).isoformat()))
     
     count = cursor.fetchone()[0]
     conn.close()
     return count
 
+def get_request_quota(user_id):
+    """Возвращает (лимит в день, использовано сегодня) одним запросом к базе"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    today = datetime.now().date()
+    cursor.execute('''
+    SELECT
+        CASE WHEN (
+            SELECT s.subscription_type
+            FROM subscriptions s
+            WHERE s.user_id = ? AND s.end_date > ?
+            ORDER BY s.end_date DESC
+            LIMIT 1
+        ) = 'premium'
+        THEN st.premium_daily_requests
+        ELSE st.free_daily_requests END,
+        (
+            SELECT COUNT(*)
+            FROM requests
+            WHERE user_id = ? AND request_date >= ? AND request_date < ?
+        )
+    FROM settings st
+    LIMIT 1
+    ''', (
+        user_id,
+        datetime.now().isoformat(),
+        user_id,
+        today.isoformat(),
+        (today + timedelta(days=1)).isoformat()
+    ))
+    
+    max_requests, used = cursor.fetchone()
+    conn.close()
+    return max_requests, used
+
+def get_all_user_ids():
+    """Идентификаторы всех пользователей (для рассылки)"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT user_id FROM users')
+    user_ids = [user_id for (user_id,) in cursor.fetchall()]
+    conn.close()
+    return user_ids
+
 def log_request(user_id, request_type):
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -282,16 +512,164 @@ def get_bot_stats():
     premium_users = cursor.fetchone()[0]
     
     cursor.execute('SELECT COUNT(*) FROM requests')
-    total_requests = cursor.fetchone()[0]
+    hot_requests = cursor.fetchone()[0]
+    
+    cursor.execute('SELECT COALESCE(SUM(requests), 0) FROM requests_archive')
+    archived_requests = cursor.fetchone()[0]
     
     conn.close()
     
     return {
         'total_users': total_users,
         'premium_users': premium_users,
-        'total_requests': total_requests
+        'total_requests': hot_requests + archived_requests,
+        'archived_requests': archived_requests
     }
 
+def append_to_archive(records):
+    """Дописывает записи запросов в сжатые помесячные файлы архива"""
+    by_month = {}
+    for record in records:
+        by_month.setdefault(record['request_date'][:7], []).append(record)
+    
+    # gzip допускает дозапись: каждая пачка - отдельный член архива
+    for month, month_records in by_month.items():
+        path = os.path.join(REQUESTS_ARCHIVE_DIR, f"requests_{month}.jsonl.gz")
+        with gzip.open(path, 'at', encoding='utf-8') as archive:
+            for record in month_records:
+                archive.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+def recover_pending_archive(cursor):
+    """Доводит до конца пачку, прерванную прошлым запуском.
+    
+    Если удаление пачки успело закоммититься, ее записи дописываются в архив;
+    если нет - строки еще в базе и будут заархивированы заново.
+    """
+    path = os.path.join(REQUESTS_ARCHIVE_DIR, ARCHIVE_PENDING_FILE)
+    if not os.path.exists(path):
+        return
+    with open(path, encoding='utf-8') as pending:
+        records = [json.loads(line) for line in pending if line.strip()]
+    
+    if records:
+        placeholders = ','.join('?' * len(records))
+        cursor.execute(f'SELECT id FROM requests WHERE id IN ({placeholders})',
+                       [record['id'] for record in records])
+        remaining = {row[0] for row in cursor.fetchall()}
+        committed = [record for record in records if record['id'] not in remaining]
+        if committed:
+            append_to_archive(committed)
+            logger.info(f"Восстановлена прерванная пачка архива: {len(committed)} запросов")
+    os.remove(path)
+
+def archive_old_requests(retention_days=None):
+    """Переносит запросы старше срока хранения в сжатый помесячный архив.
+    
+    Строки удаляются из базы небольшими пачками, чтобы не блокировать бота.
+    Пачка сначала сохраняется в файл ожидания, затем удаляется вместе
+    с обновлением сводных счетчиков в requests_archive и только после
+    коммита дописывается в архив. Так неудачный коммит не дает дублей
+    в архиве, а сбой после коммита восстанавливается при следующем запуске.
+    """
+    if retention_days is None:
+        retention_days = REQUESTS_RETENTION_DAYS
+    horizon = (datetime.now() - timedelta(days=retention_days)).isoformat()
+    os.makedirs(REQUESTS_ARCHIVE_DIR, exist_ok=True)
+    pending_path = os.path.join(REQUESTS_ARCHIVE_DIR, ARCHIVE_PENDING_FILE)
+    
+    archived = 0
+    while True:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            recover_pending_archive(cursor)
+            
+            cursor.execute('''
+            SELECT id, user_id, request_date, request_type
+            FROM requests
+            WHERE request_date < ?
+            ORDER BY request_date
+            LIMIT ?
+            ''', (horizon, RETENTION_BATCH_SIZE))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            
+            records = []
+            counts = {}
+            for row_id, user_id, request_date, request_type in rows:
+                records.append({
+                    'id': row_id,
+                    'user_id': user_id,
+                    'request_date': request_date,
+                    'request_type': request_type
+                })
+                month = request_date[:7]
+                counts[(month, request_type)] = counts.get((month, request_type), 0) + 1
+            
+            with open(pending_path, 'w', encoding='utf-8') as pending:
+                for record in records:
+                    pending.write(json.dumps(record, ensure_ascii=False) + '\n')
+                pending.flush()
+                os.fsync(pending.fileno())
+            
+            cursor.executemany('DELETE FROM requests WHERE id = ?', [(row[0],) for row in rows])
+            cursor.executemany('''
+            INSERT INTO requests_archive (month, request_type, requests)
+            VALUES (?, ?, ?)
+            ON CONFLICT (month, request_type) DO UPDATE SET requests = requests + excluded.requests
+            ''', [(month, request_type, count) for (month, request_type), count in counts.items()])
+            conn.commit()
+            
+            append_to_archive(records)
+            os.remove(pending_path)
+        finally:
+            conn.close()
+        
+        archived += len(rows)
+        time.sleep(RETENTION_BATCH_PAUSE)
+    
+    if archived:
+        logger.info(f"В архив перенесено запросов: {archived}")
+        vacuum_database()
+    return archived
+
+def vacuum_database():
+    """Возвращает свободные страницы базы по частям (инкрементальный VACUUM)"""
+    freed = 0
+    while True:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            # Без auto_vacuum = INCREMENTAL прагма ничего не делает
+            cursor.execute('PRAGMA auto_vacuum')
+            if cursor.fetchone()[0] != 2:
+                break
+            cursor.execute('PRAGMA freelist_count')
+            before = cursor.fetchone()[0]
+            if before == 0:
+                break
+            # Результат нужно дочитать, иначе VACUUM выполнится не полностью
+            cursor.execute(f'PRAGMA incremental_vacuum({VACUUM_PAGES_PER_STEP})').fetchall()
+            cursor.execute('PRAGMA freelist_count')
+            step = before - cursor.fetchone()[0]
+        finally:
+            conn.close()
+        if step <= 0:
+            break
+        freed += step
+        time.sleep(RETENTION_BATCH_PAUSE)
+    return freed
+
+async def retention_loop():
+    """Периодически архивирует старые запросы"""
+    while True:
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, archive_old_requests)
+        except Exception as e:
+            logger.error(f"Ошибка при архивации запросов: {str(e)}")
+        await asyncio.sleep(RETENTION_INTERVAL)
+
 async def start(update: Update, context: CallbackContext) -> None:
     """Отправляет приветственное сообщение"""
     user = update.effective_user
@@ -307,6 +685,7 @@ async def start(update: Update, context: CallbackContext) -> None:
         f"- Запросов в день: {settings['free_daily_requests'] if subscription['type'] == 'free' else settings['premium_daily_requests']}\n"
         "Доступные команды:\n"
         "/video [ссылка] [промт] - Анализ видео\n"
+        "/batch - Пакетный анализ нескольких видео\n"
         "/buy - Купить подписку\n"
     )
     
@@ -351,6 +730,170 @@ async def send_results(update: Update, result_url: str):
         logger.error(f"Ошибка при отправке результатов: {str(e)}")
         await update.message.reply_text(f"Вот ваша ссылка с результатами:\n{result_url}")
 
+def parse_batch_jobs(text: str):
+    """Разбирает пакет задач: по одной строке вида "<ссылка> <промт>".
+    
+    Возвращает (задачи, номера строк с ошибками).
+    """
+    jobs = []
+    errors = []
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        
+        parts = line.split(maxsplit=1)
+        url = parts[0]
+        if len(parts) < 2 or not is_valid_url(url):
+            errors.append(line_number)
+            continue
+        
+        clean_url = clean_video_url(url)
+        if 'youtube.com' not in clean_url and 'youtu.be' not in clean_url:
+            errors.append(line_number)
+            continue
+        
+        jobs.append({'url': clean_url, 'prompt': parts[1].strip()})
+    return jobs, errors
+
+async def batch_command(update: Update, context: CallbackContext) -> None:
+    """Обрабатывает команду /batch - пакетный анализ нескольких видео"""
+    user = update.effective_user
+    register_user(user.id, user.username, user.first_name, user.last_name)
+    
+    # Задачи можно передать прямо в сообщении с командой
+    parts = update.message.text.split(maxsplit=1)
+    if len(parts) > 1:
+        await run_batch(update, context, parts[1])
+        return
+    
+    context.user_data['awaiting_batch'] = True
+    await update.message.reply_text(
+        f"Отправьте до {BATCH_MAX_JOBS} задач - по одной на строку в формате:\n"
+        "<ссылка на YouTube> <промт>\n\n"
+        "Можно сообщением или текстовым файлом (.txt)."
+    )
+
+async def handle_batch_file(update: Update, context: CallbackContext) -> None:
+    """Принимает пакет задач текстовым файлом"""
+    if not context.user_data.get('awaiting_batch'):
+        return
+    
+    document = update.message.document
+    if document.file_size and document.file_size > BATCH_MAX_FILE_SIZE:
+        await update.message.reply_text("❌ Файл слишком большой.")
+        return
+    
+    file = await document.get_file()
+    data = await file.download_as_bytearray()
+    try:
+        text = bytes(data).decode('utf-8-sig')
+    except UnicodeDecodeError:
+        await update.message.reply_text("❌ Файл должен быть в кодировке UTF-8.")
+        return
+    
+    await run_batch(update, context, text)
+
+async def run_batch(update: Update, context: CallbackContext, text: str) -> None:
+    """Проверяет пакет задач и запускает его обработку в фоне"""
+    user = update.effective_user
+    context.user_data['awaiting_batch'] = False
+    
+    if context.user_data.get('batch_running'):
+        await update.message.reply_text("⏳ Дождитесь завершения текущего пакета.")
+        return
+    
+    jobs, errors = parse_batch_jobs(text)
+    if errors:
+        await update.message.reply_text(
+            f"❌ Некорректные строки: {', '.join(map(str, errors))}.\n"
+            "Формат строки: <ссылка на YouTube> <промт>"
+        )
+        return
+    if not jobs:
+        await update.message.reply_text("❌ Не найдено ни одной задачи.")
+        return
+    if len(jobs) > BATCH_MAX_JOBS:
+        await update.message.reply_text(f"❌ В пакете может быть не более {BATCH_MAX_JOBS} задач.")
+        return
+    
+    max_requests, used = get_request_quota(user.id)
+    if used + len(jobs) > max_requests:
+        await update.message.reply_text(
+            f"❌ Пакет из {len(jobs)} задач превышает дневной лимит.\n"
+            f"Осталось запросов сегодня: {max(max_requests - used, 0)} из {max_requests}.\n"
+            "Используйте /buy для покупки подписки."
+        )
+        return
+    
+    allowed, probe = ANALYSIS_BREAKER.allow()
+    if not allowed:
+        await update.message.reply_text(breaker_unavailable_text())
+        return
+    
+    context.user_data['batch_running'] = True
+    asyncio.create_task(process_batch_async(update, context, jobs, probe))
+
+async def process_batch_async(update: Update, context: CallbackContext, jobs: list, probe=False):
+    """Обрабатывает пакет в одном браузере и отправляет результаты по мере готовности"""
+    user = update.effective_user
+    loop = asyncio.get_running_loop()
+    pending = []
+    
+    async def send_batch_result(index, result):
+        nonlocal probe
+        job = jobs[index]
+        if result.get('cause') != 'breaker_open':
+            # Пробной считается только первая задача пакета
+            ANALYSIS_BREAKER.record(result.get('success', False), result.get('cause'), probe)
+            probe = False
+        header = f"{index + 1}/{len(jobs)}: {job['prompt']}"
+        if result.get('success'):
+            log_request(user.id, 'video_analysis')
+            keyboard = [[InlineKeyboardButton("🔗 Открыть результаты", url=result['results_page'])]]
+            await update.message.reply_text(f"✅ {header}", reply_markup=InlineKeyboardMarkup(keyboard))
+        else:
+            await update.message.reply_text(f"❌ {header}\nНе удалось обработать видео")
+    
+    def on_result(index, result):
+        pending.append(asyncio.run_coroutine_threadsafe(send_batch_result(index, result), loop))
+    
+    try:
+        await update.message.reply_text(f"🔄 Обрабатываю пакет из {len(jobs)} видео...")
+        # Весь пакет занимает один слот очереди - он выполняется в одном браузере
+        async with JOB_SCHEDULER.slot(get_user_tier(user.id)):
+            results = await loop.run_in_executor(
+                None,
+                lambda: process_video_batch_with_selenium(
+                    jobs, user.id, on_result,
+                    should_stop=lambda: ANALYSIS_BREAKER.state == CircuitBreaker.OPEN))
+        
+        for future in pending:
+            try:
+                await asyncio.wrap_future(future)
+            except Exception as e:
+                logger.error(f"Ошибка при отправке результата пакета: {str(e)}")
+        
+        succeeded = sum(1 for result in results if result.get('success'))
+        keyboard = [[InlineKeyboardButton("🔗 Открыть Страницу для входа:", url=login_page)]]
+        await update.message.reply_text(
+            f"📦 Пакет обработан: {succeeded} из {len(jobs)}\n\n"
+            "<b>Данные для входа в аккаунт:</b>\n"
+            f"📧 <b>Email:</b> {ACCOUNT_EMAIL}\n"
+            f"🔑 <b>Password:</b> {ACCOUNT_PASSWORD}",
+            parse_mode='HTML',
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при обработке пакета: {str(e)}")
+        await update.message.reply_text("❌ Произошла ошибка при обработке пакета")
+    finally:
+        context.user_data['batch_running'] = False
+        # Пакет упал до первого результата - пробный слот выключателя нужно вернуть
+        if probe:
+            ANALYSIS_BREAKER.record(False, 'other', probe)
+            probe = False
+
 async def buy_subscription(update: Update, context: CallbackContext):
     """Показывает информацию о покупке подписки"""
     user = update.effective_user
@@ -363,6 +906,9 @@ async def buy_subscription(update: Update, context: CallbackContext):
         f"Доступно {settings['premium_daily_requests']} запросов в день\n"
         "Без ограничений на количество запросов"
     )
+    premium_wait = JOB_SCHEDULER.wait_stats('premium')
+    if premium_wait['count']:
+        description += f"\nПриоритетная очередь: ожидание до {max(1, round(premium_wait['p95']))} с"
     payload = f"subscription_{user.id}"
     currency = "XTR"
     prices = [LabeledPrice("Премиум подписка", price)]
@@ -412,216 +958,1570 @@ async def successful_payment_callback(update: Update, context: CallbackContext):
         f"Теперь у вас {settings['premium_daily_requests']} запросов в день.\n"
         f"Подписка активна до {end_date.strftime('%d.%m.%Y')}"
     )
-async def process_video_async(update: Update, context: CallbackContext, video_url: str, prompt: str):
+class ProgressMessage:
+    """Одно сообщение о ходе задачи, которое редактируется по этапам.
+    
+    Промежуточные правки не чаще PROGRESS_MIN_EDIT_INTERVAL: если этапы
+    сменяются быстрее, показывается только последний из них.
+    """
+    
+    def __init__(self, reply_to):
+        self.reply_to = reply_to
+        self.message = None
+        self.api_calls = 0
+        self.last_text = None
+        self.last_edit = 0
+        self.pending_text = None
+        self.flush_handle = None
+        self.finished = False
+        self.lock = asyncio.Lock()
+    
+    async def start(self, stage):
+        """Отправляет исходное сообщение"""
+        self.last_text = format_progress(stage)
+        self.message = await self.reply_to.reply_text(self.last_text)
+        self.api_calls += 1
+        self.last_edit = time.monotonic()
+    
+    def set_stage(self, stage, current=None, total=None):
+        """Планирует правку сообщения с учетом ограничения частоты"""
+        self.pending_text = format_progress(stage, current, total)
+        if self.flush_handle is not None:
+            return
+        
+        delay = max(0.0, self.last_edit + PROGRESS_MIN_EDIT_INTERVAL - time.monotonic())
+        self.flush_handle = asyncio.get_running_loop().call_later(
+            delay, lambda: asyncio.ensure_future(self._flush()))
+    
+    async def _flush(self):
+        self.flush_handle = None
+        text, self.pending_text = self.pending_text, None
+        if text and text != self.last_text:
+            try:
+                await self._edit(text)
+            except Exception as e:
+                logger.error(f"Ошибка при обновлении хода задачи: {str(e)}")
+    
+    async def _edit(self, text, final=False, **kwargs):
+        async with self.lock:
+            # Запоздавшая промежуточная правка не должна затереть результат
+            if self.finished and not final:
+                return
+            try:
+                await self.message.edit_text(text, **kwargs)
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+                await self.message.edit_text(text, **kwargs)
+            except BadRequest as e:
+                # Текст не изменился - не ошибка
+                if 'not modified' not in str(e).lower():
+                    raise
+            finally:
+                self.api_calls += 1
+                self.last_edit = time.monotonic()
+            self.last_text = text
+    
+    async def finish(self, text, **kwargs):
+        """Итоговая правка: результат заменяет сообщение о ходе задачи"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        self.pending_text = None
+        self.finished = True
+        
+        if self.message is None:
+            await self.reply_to.reply_text(text, **kwargs)
+            self.api_calls += 1
+            return
+        try:
+            await self._edit(text, final=True, **kwargs)
+        except Exception as e:
+            logger.error(f"Ошибка при редактировании сообщения: {str(e)}")
+            await self.reply_to.reply_text(text, **kwargs)
+            self.api_calls += 1
+
+def format_progress(stage, current=None, total=None) -> str:
+    """Текст сообщения о ходе задачи"""
+    text = PROGRESS_STAGES[stage]
+    if total and total > 1:
+        text += f" ({current}/{total})"
+    return text
+
+async def process_video_async(update: Update, context: CallbackContext, video_url: str, prompts: list):
     """Асинхронная обработка видео с использованием Selenium"""
     user = update.effective_user
+    job_started = time.monotonic()
+    loop = asyncio.get_running_loop()
+    progress = ProgressMessage(update.message)
+    
+    def on_stage(stage, *args):
+        # Для одного промта вход - часть анализа: отдельная правка ради него не нужна
+        if stage == 'login' and len(prompts) == 1:
+            stage = 'analyzing'
+        loop.call_soon_threadsafe(progress.set_stage, stage, *args)
+    
+    allowed, probe = ANALYSIS_BREAKER.allow()
+    if not allowed:
+        cancel_speculation(user.id, 'cancelled')
+        await progress.finish(breaker_unavailable_text())
+        return
+    result = None
+    session = None
+    session_handed_over = False
     
     try:
-        # Уведомляем пользователя о начале обработки
-        processing_msg = await update.message.reply_text("🔄 Обрабатываю видео, пожалуйста подождите...")
+        # Предзагрузка еще запускает браузер и входит в аккаунт - ждать ее
+        # без сообщения о ходе задачи пользователь не должен
+        speculation = SPECULATIONS.get(user.id)
+        if speculation and speculation['url'] == video_url and not speculation['task'].done():
+            await progress.start('analyzing' if len(prompts) == 1 else 'login')
+        
+        # Если страница видео уже предзагружена, слот очереди занят заранее
+        # и остается только отправить промт
+        session, tier = await take_speculation(user.id, video_url)
+        if session is not None:
+            job_slot = JOB_SCHEDULER.held(tier)
+        else:
+            # Ждем свободный браузер с учетом приоритета тарифа.
+            # Сообщение об очереди - только если свободного слота нет
+            tier = get_user_tier(user.id)
+            if not JOB_SCHEDULER.has_free_slot(tier):
+                await progress.start('queued')
+            job_slot = JOB_SCHEDULER.slot(tier)
         
         # Запускаем обработку видео в отдельном потоке
-        result = await asyncio.get_event_loop().run_in_executor(
-            None, 
-            lambda: process_video_with_selenium(video_url, prompt))
+        async with job_slot:
+            if progress.message is None:
+                await progress.start('analyzing')
+            # Дальше предзагруженную сессию закрывает process_video_with_selenium
+            session_handed_over = True
+            result = await loop.run_in_executor(
+                None, 
+                lambda: process_video_with_selenium(video_url, prompts, user.id, on_stage, session))
         
         if not result or not result.get("success", False):
-            await update.message.reply_text("❌ Не удалось обработать видео")
+            await progress.finish("❌ Не удалось обработать видео")
             return
         
-        # Формируем сообщение с результатами
-        k = [[InlineKeyboardButton("🔗Ссылка на результаты:", result['results_page'])]]
+        # Формируем сообщение с результатами: по кнопке на каждый промт
+        # и кнопка страницы входа - все в одном сообщении
+        k = []
+        failed = []
+        for number, item in enumerate(result['results'], start=1):
+            if item['success']:
+                title = "🔗Ссылка на результаты:" if len(prompts) == 1 else f"🔗 {number}. {shorten_prompt(item['prompt'])}"
+                k.append([InlineKeyboardButton(title, item['results_page'])])
+            else:
+                failed.append(str(number))
+        k.append([InlineKeyboardButton("🔗 Открыть Страницу для входа:", url=login_page)])
         reply_markup = InlineKeyboardMarkup(k)
         message = (
             "✅ <b>Анализ видео завершен!</b>\n\n"
-            "<b>Данные для входа в аккаунт:</b>\n"
+            + (f"❌ Не удалось обработать промты: {', '.join(failed)}\n\n" if failed else "")
+            + "<b>Данные для входа в аккаунт:</b>\n"
             f"📧 <b>Email:</b> {result['login_credentials']['email']}\n"
             f"🔑 <b>Password:</b> {result['login_credentials']['password']}"
         )
         
-        # Отправляем основное сообщение с результатами
-        await update.message.reply_text(message, parse_mode='HTML', reply_markup=reply_markup)
+        await progress.finish(message, parse_mode='HTML', reply_markup=reply_markup)
         
-        # Создаем кнопку для открытия результатов
-        keyboard = [[InlineKeyboardButton("🔗 Открыть Страницу для входа:", url=login_page)]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        # Отправляем кнопку отдельным сообщением
-        await update.message.reply_text(
-            "Нажмите кнопку ниже, чтобы открыть входа:",
-            reply_markup=reply_markup)
-        
-        # Логируем успешный запрос
-        log_request(user.id, 'video_analysis')
+        # Каждый успешный промт - отдельный запрос для лимитов
+        for item in result['results']:
+            if item['success']:
+                log_request(user.id, 'video_analysis')
+        report_startup_metric('first_job', "Первая задача после запуска выполнена за",
+                              time.monotonic() - job_started)
         
     except Exception as e:
         logger.error(f"Ошибка при обработке видео: {str(e)}")
-        await update.message.reply_text("❌ Произошла ошибка при обработке видео")
+        await progress.finish("❌ Произошла ошибка при обработке видео")
     finally:
-        # Удаляем сообщение о процессе обработки
-        try:
-            await context.bot.delete_message(
-                chat_id=processing_msg.chat_id,
-                message_id=processing_msg.message_id
+        if session is not None and not session_handed_over:
+            # Задача упала до запуска браузера - предзагруженная сессия не должна утечь
+            loop.run_in_executor(None, release_job_session, session)
+        if result:
+            ANALYSIS_BREAKER.record(result.get('success', False), result.get('cause'), probe)
+        else:
+            ANALYSIS_BREAKER.record(False, 'other', probe)
+        logger.info(f"Задача пользователя {user.id}: запросов к Telegram API - {progress.api_calls}")
+
+def percentile(values, percent):
+    """Перцентиль выборки (метод ближайшего ранга)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(percent / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+class LoopMonitor:
+    """Следит за отзывчивостью цикла событий.
+    
+    Сэмплер в цикле событий регулярно просыпается и замеряет опоздание.
+    Сторожевой поток замечает, что сэмплер давно не просыпался, и снимает
+    стек потока цикла событий - это и есть код, который его держит.
+    Обработчики Telegram обернуты в wrap() для учета времени выполнения.
+    """
+    
+    def __init__(self):
+        self.enabled = False
+        self.task = None
+        self.watchdog = None
+        self.loop_thread_id = None
+        self.heartbeat = 0.0
+        self.stall_site = None
+        self.reset()
+    
+    def reset(self):
+        """Сбрасывает накопленную статистику"""
+        self.lags = deque(maxlen=3000)
+        self.blocking_sites = {}
+        self.handlers = {}
+        self.since = time.monotonic()
+    
+    def start(self):
+        """Включает мониторинг; вызывается из цикла событий"""
+        if self.enabled:
+            return
+        self.enabled = True
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.task = asyncio.create_task(self._sample())
+        # Поток от прошлого включения мог еще не завершиться - он продолжит работу
+        if self.watchdog is None or not self.watchdog.is_alive():
+            self.watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+            self.watchdog.start()
+        logger.info("Мониторинг цикла событий включен")
+    
+    def stop(self):
+        """Выключает мониторинг"""
+        if not self.enabled:
+            return
+        self.enabled = False
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        logger.info("Мониторинг цикла событий выключен")
+    
+    async def _sample(self):
+        while self.enabled:
+            expected = time.monotonic() + LOOP_MONITOR_INTERVAL
+            await asyncio.sleep(LOOP_MONITOR_INTERVAL)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self.lags.append(lag)
+            self.heartbeat = now
+            
+            if lag >= LOOP_BLOCK_THRESHOLD:
+                site, self.stall_site = self.stall_site or 'неизвестно', None
+                stats = self.blocking_sites.setdefault(site, {'count': 0, 'total': 0.0, 'max': 0.0})
+                stats['count'] += 1
+                stats['total'] += lag
+                stats['max'] = max(stats['max'], lag)
+    
+    def _watch(self):
+        reported_heartbeat = None
+        while self.enabled:
+            time.sleep(LOOP_MONITOR_INTERVAL)
+            heartbeat = self.heartbeat
+            if heartbeat == reported_heartbeat:
+                continue
+            
+            blocked_for = time.monotonic() - heartbeat - LOOP_MONITOR_INTERVAL
+            if blocked_for < LOOP_BLOCK_THRESHOLD:
+                continue
+            
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            self.stall_site = self._find_site(stack)
+            reported_heartbeat = heartbeat
+            logger.warning(
+                f"Цикл событий заблокирован более {blocked_for:.2f} с: {self.stall_site}\n"
+                + ''.join(traceback.format_list(stack[-15:]))
             )
-        except:
+    
+    @staticmethod
+    def _find_site(stack):
+        """Место блокировки: ближайший к вершине стека кадр из bot.py и сама вершина"""
+        top = stack[-1]
+        own = next((entry for entry in reversed(stack) if entry.filename == __file__), None)
+        site = f"{os.path.basename(top.filename)}:{top.lineno} {top.name}"
+        if own is not None and own is not top:
+            site = f"bot.py:{own.lineno} {own.name} -> {site}"
+        return site
+    
+    def wrap(self, callback):
+        """Оборачивает обработчик для учета времени его выполнения"""
+        name = getattr(callback, '__name__', repr(callback))
+        
+        @functools.wraps(callback)
+        async def timed(update, context):
+            if not self.enabled:
+                return await callback(update, context)
+            started = time.monotonic()
+            try:
+                return await callback(update, context)
+            finally:
+                elapsed = time.monotonic() - started
+                stats = self.handlers.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0})
+                stats['count'] += 1
+                stats['total'] += elapsed
+                stats['max'] = max(stats['max'], elapsed)
+        return timed
+    
+    def report(self) -> str:
+        """Компактный отчет для администратора"""
+        lags = list(self.lags)
+        lines = [
+            f"🩺 Цикл событий ({'включен' if self.enabled else 'выключен'}, "
+            f"за {int(time.monotonic() - self.since)} с):",
+            f"Лаг p50/p99/max: {percentile(lags, 50) * 1000:.0f} / "
+            f"{percentile(lags, 99) * 1000:.0f} / {max(lags, default=0) * 1000:.0f} мс",
+            f"\nБлокировки дольше {LOOP_BLOCK_THRESHOLD} с:"
+        ]
+        sites = sorted(self.blocking_sites.items(), key=lambda item: item[1]['total'], reverse=True)
+        for site, stats in sites[:5]:
+            lines.append(f"- {site}: {stats['count']} раз, всего {stats['total']:.1f} с, max {stats['max']:.1f} с")
+        if not sites:
+            lines.append("- нет")
+        
+        lines.append("\nОбработчики (всего / среднее / max):")
+        handlers = sorted(self.handlers.items(), key=lambda item: item[1]['total'], reverse=True)
+        for name, stats in handlers[:8]:
+            lines.append(
+                f"- {name}: {stats['count']} × {stats['total'] / stats['count'] * 1000:.0f} мс, "
+                f"всего {stats['total']:.1f} с, max {stats['max'] * 1000:.0f} мс"
+            )
+        if not handlers:
+            lines.append("- нет данных")
+        return "\n".join(lines)
+
+LOOP_MONITOR = LoopMonitor()
+
+def report_startup_metric(name: str, description: str, value: float = None):
+    """Фиксирует и логирует метрику запуска (только первое значение)"""
+    if name in STARTUP_METRICS:
+        return
+    if value is None:
+        value = time.monotonic() - BOOT_TIME
+    STARTUP_METRICS[name] = value
+    logger.info(f"⏱ {description}: {value:.2f} с")
+
+def load_selenium():
+    """Импортирует Selenium при первом использовании"""
+    global webdriver, By, Keys, Service, WebDriverWait, EC
+    global TimeoutException, NoSuchElementException, WebDriverException, WebElement
+    
+    if webdriver is not None:
+        return
+    
+    with _selenium_lock:
+        if webdriver is not None:
+            return
+        
+        started = time.monotonic()
+        from selenium.webdriver.common.by import By as _By
+        from selenium.webdriver.common.keys import Keys as _Keys
+        from selenium.webdriver.chrome.service import Service as _Service
+        from selenium.webdriver.support.ui import WebDriverWait as _WebDriverWait
+        from selenium.webdriver.support import expected_conditions as _EC
+        from selenium.common.exceptions import (
+            TimeoutException as _TimeoutException,
+            NoSuchElementException as _NoSuchElementException,
+            WebDriverException as _WebDriverException
+        )
+        from selenium.webdriver.remote.webelement import WebElement as _WebElement
+        from selenium import webdriver as _webdriver
+        
+        By, Keys, Service, WebDriverWait, EC = _By, _Keys, _Service, _WebDriverWait, _EC
+        TimeoutException = _TimeoutException
+        NoSuchElementException = _NoSuchElementException
+        WebDriverException = _WebDriverException
+        WebElement = _WebElement
+        # webdriver присваивается последним: по нему проверяется готовность
+        webdriver = _webdriver
+        
+        logger.info(f"Selenium загружен за {time.monotonic() - started:.2f} с")
+
+def create_chrome_driver():
+    """Запускает Chrome с настройками бота"""
+    load_selenium()
+    
+    service = Service(executable_path=CHROME_DRIVER_PATH)
+    options = webdriver.ChromeOptions()
+    
+    options.add_argument("--start-maximized")
+    options.add_argument("--disable-blink-features=AutomationControlled")
+    options.add_argument("--ignore-certificate-errors")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--no-sandbox")
+    options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    options.add_experimental_option('useAutomationExtension', False)
+    if BROWSER_MODE == 'tabs':
+        # Фоновые вкладки не должны замедляться, пока с ними не работают
+        options.add_argument("--disable-background-timer-throttling")
+        options.add_argument("--disable-backgrounding-occluded-windows")
+        options.add_argument("--disable-renderer-backgrounding")
+    
+    return webdriver.Chrome(service=service, options=options)
+
+def load_psutil():
+    """Возвращает модуль psutil или None, если он не установлен"""
+    try:
+        import psutil
+        return psutil
+    except ImportError:
+        return None
+
+def get_process_tree(pid):
+    """Возвращает процесс и всех его потомков (нужен psutil)"""
+    psutil = load_psutil()
+    if psutil is None or pid is None:
+        return []
+    try:
+        process = psutil.Process(pid)
+        return [process] + process.children(recursive=True)
+    except psutil.Error:
+        return []
+
+def get_processes_memory_mb(processes):
+    """Суммарная память (RSS) процессов в мегабайтах"""
+    psutil = load_psutil()
+    total = 0
+    for process in processes:
+        try:
+            total += process.memory_info().rss
+        except psutil.Error:
             pass
+    return total / (1024 * 1024)
 
-def process_video_with_selenium(video_url: str, prompt: str) -> dict:
-    """Функция для обработки видео с использованием Selenium"""
-    driver = None
+def get_driver_pid(driver):
+    """PID процесса chromedriver для драйвера"""
     try:
-        # Инициализация браузера
-        service = Service(executable_path=CHROME_DRIVER_PATH)
-        options = webdriver.ChromeOptions()
-        
-        options.add_argument("--start-maximized")
-        options.add_argument("--disable-blink-features=AutomationControlled")
-        options.add_argument("--ignore-certificate-errors")
-        options.add_argument("--disable-dev-shm-usage")
-        options.add_argument("--no-sandbox")
-        options.add_experimental_option("excludeSwitches", ["enable-automation"])
-        options.add_experimental_option('useAutomationExtension', False)
+        return driver.service.process.pid
+    except AttributeError:
+        return None
+
+def register_browser_session(driver, owner, purpose, busy=True):
+    """Регистрирует драйвер в реестре браузерных сессий"""
+    now = time.monotonic()
+    session = {
+        'id': next(_browser_session_ids),
+        'driver': driver,
+        'pid': get_driver_pid(driver),
+        'owner': owner,
+        'purpose': purpose,
+        'created': now,
+        'last_used': now,
+        'busy': busy
+    }
+    with _browser_sessions_lock:
+        BROWSER_SESSIONS[session['id']] = session
+    logger.info(f"Браузер #{session['id']} открыт ({purpose}, владелец {owner})")
+    return session
+
+def open_browser_session(owner, purpose):
+    """Запускает новый Chrome с учетом лимита памяти и регистрирует его"""
+    if get_browsers_memory_mb() >= BROWSER_MEMORY_LIMIT_MB:
+        reap_browser_sessions()
+        if get_browsers_memory_mb() >= BROWSER_MEMORY_LIMIT_MB:
+            raise RuntimeError("Превышен лимит памяти для браузеров")
+    
+    return register_browser_session(create_chrome_driver(), owner, purpose)
+
+def get_browser_session(session_id):
+    """Возвращает сессию из реестра или None"""
+    with _browser_sessions_lock:
+        return BROWSER_SESSIONS.get(session_id)
+
+def touch_browser_session(session, busy=None):
+    """Отмечает использование сессии; работа во вкладке отмечается и в общем браузере"""
+    session['last_used'] = time.monotonic()
+    if 'browser' in session:
+        session['browser']['last_used'] = session['last_used']
+    if busy is not None:
+        session['busy'] = busy
+
+def close_browser_session(session):
+    """Закрывает браузер и удаляет его из реестра"""
+    if session is None:
+        return
+    with _browser_sessions_lock:
+        if BROWSER_SESSIONS.pop(session['id'], None) is None:
+            return
+    
+    processes = get_process_tree(session['pid'])
+    try:
+        session['driver'].quit()
+    except:
+        pass
+    # Добиваем процессы, которые пережили quit()
+    for process in processes:
+        try:
+            if process.is_running():
+                process.kill()
+        except Exception:
+            pass
+    logger.info(f"Браузер #{session['id']} закрыт ({session['purpose']})")
+
+def get_browsers_memory_mb():
+    """Суммарная память всех зарегистрированных браузеров"""
+    with _browser_sessions_lock:
+        pids = [session['pid'] for session in BROWSER_SESSIONS.values()]
+    processes = []
+    for pid in pids:
+        processes.extend(get_process_tree(pid))
+    return get_processes_memory_mb(processes)
+
+def find_orphan_browser_processes():
+    """Процессы chrome/chromedriver, порожденные ботом, но не принадлежащие ни одной сессии"""
+    psutil = load_psutil()
+    if psutil is None:
+        return []
+    
+    with _browser_sessions_lock:
+        pids = [session['pid'] for session in BROWSER_SESSIONS.values()]
+    known = set()
+    for pid in pids:
+        known.update(process.pid for process in get_process_tree(pid))
+    
+    orphans = []
+    now = time.time()
+    for process in psutil.Process().children(recursive=True):
+        try:
+            name = process.name().lower()
+            age = now - process.create_time()
+        except psutil.Error:
+            continue
+        if 'chrome' in name and process.pid not in known and age > BROWSER_ORPHAN_GRACE:
+            orphans.append(process)
+    return orphans
+
+def reap_browser_sessions():
+    """Закрывает простаивающие и зависшие сессии, убивает осиротевшие процессы.
+    
+    Занятая сессия старше BROWSER_MAX_LIFETIME закрывается, только если она
+    перестала продвигаться: длинный пакет или видео с несколькими промтами
+    отмечают каждую задачу и не обрываются посреди работы.
+    """
+    now = time.monotonic()
+    with _browser_sessions_lock:
+        sessions = list(BROWSER_SESSIONS.values())
+    
+    reaped = 0
+    for session in sessions:
+        idle_timeout = BROWSER_IDLE_TIMEOUTS.get(session['purpose'], BROWSER_IDLE_TIMEOUT)
+        if not session['busy'] and now - session['last_used'] > idle_timeout:
+            logger.warning(f"Браузер #{session['id']} простаивал слишком долго")
+        elif (now - session['created'] > BROWSER_MAX_LIFETIME
+              and (not session['busy'] or now - session['last_used'] > BROWSER_STALL_TIMEOUT)):
+            logger.warning(f"Браузер #{session['id']} превысил максимальное время жизни")
+        else:
+            continue
+        close_browser_session(session)
+        reaped += 1
+    
+    # Жесткий лимит памяти: закрываем свободные сессии, начиная с самых давних
+    idle = sorted(
+        (session for session in sessions if not session['busy'] and session['id'] in BROWSER_SESSIONS),
+        key=lambda session: session['last_used']
+    )
+    while idle and get_browsers_memory_mb() > BROWSER_MEMORY_LIMIT_MB:
+        session = idle.pop(0)
+        logger.warning(f"Браузер #{session['id']} закрыт из-за лимита памяти")
+        close_browser_session(session)
+        reaped += 1
+    
+    orphans = find_orphan_browser_processes()
+    for process in orphans:
+        try:
+            process.kill()
+        except Exception:
+            pass
+    if orphans:
+        logger.warning(f"Убито осиротевших процессов браузера: {len(orphans)}")
+    
+    return {'sessions': reaped, 'orphans': len(orphans)}
+
+async def browser_reaper_loop():
+    """Периодически запускает очистку браузерных сессий"""
+    while True:
+        await asyncio.sleep(BROWSER_REAPER_INTERVAL)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, reap_browser_sessions)
+        except Exception as e:
+            logger.error(f"Ошибка при очистке браузеров: {str(e)}")
+
+def prewarm_browser():
+    """Готовит авторизованный браузер в фоне, пока бот уже отвечает на сообщения"""
+    session = None
+    try:
+        session = open_browser_session(None, 'prewarm')
+        if not login_with_selenium(session['driver'], ACCOUNT_EMAIL, ACCOUNT_PASSWORD):
+            logger.warning("Прогрев браузера: не удалось авторизоваться")
+            close_browser_session(session)
+            return
         
-        driver = webdriver.Chrome(service=service, options=options)
+        touch_browser_session(session, busy=False)
+        report_startup_metric('prewarm', "Браузер прогрет")
+    except Exception as e:
+        logger.error(f"Ошибка при прогреве браузера: {str(e)}")
+        close_browser_session(session)
+
+def take_prewarmed_session(owner, purpose):
+    """Забирает свободный прогретый браузер, если он есть"""
+    with _browser_sessions_lock:
+        for session in BROWSER_SESSIONS.values():
+            if session['purpose'] == 'prewarm' and not session['busy']:
+                session['owner'] = owner
+                session['purpose'] = purpose
+                touch_browser_session(session, busy=True)
+                return session
+    return None
+
+def open_authenticated_session(owner, purpose):
+    """Возвращает авторизованную браузерную сессию или None при ошибке входа"""
+    # Используем прогретый браузер, если он уже авторизован
+    session = take_prewarmed_session(owner, purpose)
+    if session is not None:
+        return session
+    
+    session = open_browser_session(owner, purpose)
+    try:
+        logged_in = login_with_selenium(session['driver'], ACCOUNT_EMAIL, ACCOUNT_PASSWORD)
+    except Exception:
+        close_browser_session(session)
+        raise
+    if not logged_in:
+        close_browser_session(session)
+        return None
+    return session
+
+def is_driver_alive(driver) -> bool:
+    """Проверяет, что браузер еще отвечает"""
+    try:
+        driver.current_url
+        return True
+    except Exception:
+        return False
+
+class TabDriver:
+    """Драйвер одной вкладки общего браузера.
+    
+    Перед каждой командой переключается на свое окно под блокировкой браузера,
+    поэтому задачи в соседних вкладках не мешают друг другу. Блокировка
+    держится только на время команды: ожидания WebDriverWait и time.sleep
+    разных вкладок идут параллельно.
+    """
+    
+    def __init__(self, browser, handle):
+        self._browser = browser
+        self._handle = handle
+    
+    def _call(self, action):
+        browser = self._browser
+        with browser['lock']:
+            if browser['active_handle'] != self._handle:
+                browser['driver'].switch_to.window(self._handle)
+                browser['active_handle'] = self._handle
+            return self._wrap(action())
+    
+    def _wrap(self, value):
+        if WebElement is not None and isinstance(value, WebElement):
+            return TabElement(self, value)
+        if isinstance(value, list):
+            return [self._wrap(item) for item in value]
+        return value
+    
+    def __getattr__(self, name):
+        value = self._call(lambda: getattr(self._browser['driver'], name))
+        if callable(value):
+            return lambda *args, **kwargs: self._call(lambda: value(*args, **kwargs))
+        return value
+
+class TabElement:
+    """Элемент страницы во вкладке: команды выполняются в окне своей вкладки"""
+    
+    def __init__(self, tab_driver, element):
+        self._tab_driver = tab_driver
+        self._element = element
+    
+    def __getattr__(self, name):
+        value = self._tab_driver._call(lambda: getattr(self._element, name))
+        if callable(value):
+            return lambda *args, **kwargs: self._tab_driver._call(lambda: value(*args, **kwargs))
+        return value
+
+def open_shared_browser():
+    """Запускает и авторизует общий браузер; первая вкладка в нем занята за вызывающим"""
+    session = open_authenticated_session(None, 'shared')
+    if session is None:
+        return None
+    with _browser_sessions_lock:
+        session.update({
+            'lock': threading.RLock(),
+            'tabs': {},
+            'active_handle': session['driver'].current_window_handle,
+            'opening': 1,
+            'retired': False
+        })
+    return session
+
+def find_shared_browser():
+    """Общий браузер со свободной вкладкой; место под вкладку сразу занимается"""
+    now = time.monotonic()
+    with _browser_sessions_lock:
+        for session in BROWSER_SESSIONS.values():
+            if session['purpose'] != 'shared' or 'tabs' not in session or session['retired']:
+                continue
+            # Старый браузер больше не получает вкладок: он доработает текущие
+            # и закроется, не дожидаясь жесткого лимита времени жизни
+            if now - session['created'] > BROWSER_MAX_LIFETIME / 2:
+                session['retired'] = True
+                continue
+            if len(session['tabs']) + session['opening'] < TABS_PER_BROWSER:
+                session['opening'] += 1
+                touch_browser_session(session, busy=True)
+                return session
+    return None
+
+def open_tab_session(owner, purpose):
+    """Открывает вкладку для задачи в общем браузере, при необходимости запускает новый"""
+    browser = find_shared_browser()
+    if browser is None:
+        # Запуски сериализуются: пока стартует один браузер, другие потоки
+        # ждут и затем занимают в нем вкладки
+        with _shared_browsers_lock:
+            browser = find_shared_browser() or open_shared_browser()
+        if browser is None:
+            return None
+    
+    try:
+        with browser['lock']:
+            browser['driver'].switch_to.new_window('tab')
+            handle = browser['driver'].current_window_handle
+            browser['active_handle'] = handle
+            # tabs и opening меняются только под _browser_sessions_lock
+            with _browser_sessions_lock:
+                browser['tabs'][handle] = owner
+    except Exception:
+        # Браузер, который не смог открыть вкладку, новых задач не получает
+        with _browser_sessions_lock:
+            browser['retired'] = True
+        raise
+    finally:
+        with _browser_sessions_lock:
+            browser['opening'] -= 1
+        settle_shared_browser(browser)
+    
+    now = time.monotonic()
+    return {
+        'id': f"{browser['id']}/{handle[:8]}",
+        'driver': TabDriver(browser, handle),
+        'browser': browser,
+        'handle': handle,
+        'owner': owner,
+        'purpose': purpose,
+        'created': now,
+        'last_used': now,
+        'busy': True
+    }
+
+def close_tab_session(tab):
+    """Закрывает вкладку задачи.
+    
+    Ошибка задачи не задевает соседние вкладки: закрывается только ее окно.
+    Если сам браузер перестал отвечать, он больше не получает вкладок
+    и закрывается вместе с последней из них.
+    """
+    browser = tab['browser']
+    with browser['lock']:
+        try:
+            browser['driver'].switch_to.window(tab['handle'])
+            browser['driver'].close()
+        except Exception as e:
+            logger.warning(f"Не удалось закрыть вкладку {tab['id']}: {str(e)}")
+            try:
+                # Текущее окно может быть закрыто - проверяем сам браузер
+                browser['driver'].window_handles
+            except Exception:
+                with _browser_sessions_lock:
+                    browser['retired'] = True
+        browser['active_handle'] = None
+        with _browser_sessions_lock:
+            browser['tabs'].pop(tab['handle'], None)
+    settle_shared_browser(browser)
+
+def settle_shared_browser(browser):
+    """Отмечает занятость общего браузера; выведенный из работы закрывается с последней вкладкой.
+    
+    Проверка и отметка идут под _browser_sessions_lock, как и занятие вкладки
+    в find_shared_browser, иначе браузер можно пометить свободным сразу после
+    того, как ему выдали новую вкладку.
+    """
+    with _browser_sessions_lock:
+        idle = not browser['tabs'] and not browser['opening']
+        close = idle and browser['retired']
+        if not close:
+            touch_browser_session(browser, busy=not idle)
+    
+    if close:
+        close_browser_session(browser)
+
+def open_job_session(owner, purpose):
+    """Авторизованная сессия для задачи анализа в текущем режиме браузеров"""
+    if BROWSER_MODE == 'tabs':
+        return open_tab_session(owner, purpose)
+    return open_authenticated_session(owner, purpose)
+
+def release_job_session(session):
+    """Завершает сессию задачи: закрывает вкладку или весь браузер"""
+    if session is None:
+        return
+    if 'browser' in session:
+        close_tab_session(session)
+    else:
+        close_browser_session(session)
+
+def process_video_with_selenium(video_url: str, prompts: list, owner=None, on_stage=None, session=None) -> dict:
+    """Функция для обработки видео с использованием Selenium.
+    
+    Все промты выполняются на одной загруженной странице видео,
+    в results возвращается по одной ссылке на каждый промт.
+    on_stage(stage, current, total) сообщает о смене этапа из рабочего потока.
+    session - предзагруженная сессия с уже открытой страницей видео.
+    """
+    page_loaded = session is not None
+    try:
+        if session is None:
+            if on_stage:
+                on_stage('login')
+            session = open_job_session(owner, 'video')
+            if session is None:
+                return {"success": False, "error": "Ошибка авторизации", "cause": 'login_failed'}
+        else:
+            session['purpose'] = 'video'
+            touch_browser_session(session, busy=True)
+        driver = session['driver']
         
-        if not login_with_selenium(driver, ACCOUNT_EMAIL, ACCOUNT_PASSWORD):
-            return {"success": False, "error": "Ошибка авторизации"}
+        def on_prompt_stage(stage, *args):
+            # Каждый промт отмечает сессию, чтобы очистка не сочла ее зависшей
+            touch_browser_session(session)
+            if on_stage:
+                on_stage(stage, *args)
         
-        success, result = process_video_selenium(driver, video_url, prompt)
+        results = [
+            {"prompt": prompt, "success": success, "results_page": results_url, "cause": cause}
+            for prompt, (success, results_url, cause)
+            in zip(prompts, process_video_prompts_selenium(
+                driver, video_url, prompts, page_loaded=page_loaded, on_stage=on_prompt_stage))
+        ]
         
-        if not success:
-            return {"success": False, "error": "Ошибка обработки видео"}
+        if not any(result["success"] for result in results):
+            return {"success": False, "error": "Ошибка обработки видео", "cause": results[0]["cause"]}
             
         return {
             "success": True,
-            "results_page": result["results_page"],
-            "login_credentials": result["login_credentials"]
+            "results": results,
+            "login_credentials": {
+                "email": ACCOUNT_EMAIL,
+                "password": ACCOUNT_PASSWORD
+            }
         }
             
     except Exception as e:
         logger.error(f"Ошибка в process_video_with_selenium: {str(e)}")
-        return {"success": False, "error": str(e)}
+        return {"success": False, "error": str(e), "cause": classify_failure(e)}
     finally:
-        if driver:
-            try:
-                driver.quit()
-            except:
-                pass
+        release_job_session(session)
+        flush_stage_timings()
+
+def process_video_batch_with_selenium(jobs: list, owner=None, on_result=None, should_stop=None) -> list:
+    """Обрабатывает несколько видео подряд в одной авторизованной сессии.
+    
+    on_result(index, result) вызывается после каждой задачи из рабочего потока.
+    Если should_stop() вернет True, оставшиеся задачи не выполняются.
+    """
+    results = []
+    session = None
+    loaded_url = None
+    try:
+        for index, job in enumerate(jobs):
+            if should_stop and should_stop():
+                result = {"success": False, "error": "Сервис анализа недоступен", "cause": 'breaker_open'}
+            else:
+                if session is None:
+                    session = open_job_session(owner, 'batch')
+                    loaded_url = None
+                
+                if session is None:
+                    result = {"success": False, "error": "Ошибка авторизации", "cause": 'login_failed'}
+                else:
+                    result = process_batch_job_selenium(session, job, loaded_url == job['url'])
+                    loaded_url = job['url'] if result['success'] else None
+                    # Упавший браузер перезапускаем для оставшихся задач
+                    if not result['success'] and not is_driver_alive(session['driver']):
+                        release_job_session(session)
+                        session = None
+            
+            results.append(result)
+            if on_result:
+                on_result(index, result)
+    except Exception as e:
+        logger.error(f"Ошибка в process_video_batch_with_selenium: {str(e)}")
+        for index in range(len(results), len(jobs)):
+            result = {"success": False, "error": str(e), "cause": classify_failure(e)}
+            results.append(result)
+            if on_result:
+                on_result(index, result)
+    finally:
+        release_job_session(session)
+        flush_stage_timings()
+    
+    return results
+
+def process_batch_job_selenium(session, job, page_loaded):
+    """Одна задача пакета в уже авторизованной сессии"""
+    touch_browser_session(session)
+    # Подряд идущие задачи по одному видео не перезагружают страницу
+    [(success, results_url, cause)] = process_video_prompts_selenium(
+        session['driver'], job['url'], [job['prompt']], page_loaded=page_loaded)
+    if success:
+        return {"success": True, "results_page": results_url}
+    return {"success": False, "error": "Ошибка обработки видео", "cause": cause}
+
+def load_stage_timings():
+    """Загружает из базы последние длительности этапов Selenium"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    for stage in STAGE_TIMEOUTS:
+        cursor.execute('''
+        SELECT duration FROM stage_timings
+        WHERE stage = ?
+        ORDER BY id DESC
+        LIMIT ?
+        ''', (stage, STAGE_TIMING_WINDOW))
+        durations = [row[0] for row in reversed(cursor.fetchall())]
+        with _stage_timings_lock:
+            STAGE_TIMINGS[stage] = deque(durations, maxlen=STAGE_TIMING_WINDOW)
+    
+    conn.close()
+
+def record_stage_duration(stage, duration):
+    """Запоминает длительность успешного этапа; в базу она попадет при flush_stage_timings"""
+    with _stage_timings_lock:
+        STAGE_TIMINGS.setdefault(stage, deque(maxlen=STAGE_TIMING_WINDOW)).append(duration)
+        _stage_timings_pending.append((stage, duration, datetime.now().isoformat()))
+
+def flush_stage_timings():
+    """Сохраняет накопленные замеры этапов в базу одной транзакцией (в конце задачи)"""
+    with _stage_timings_lock:
+        pending = list(_stage_timings_pending)
+        _stage_timings_pending.clear()
+    if not pending:
+        return
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.executemany('''
+        INSERT INTO stage_timings (stage, duration, recorded_at)
+        VALUES (?, ?, ?)
+        ''', pending)
+        # В базе храним только окно последних замеров
+        for stage in {stage for stage, _, _ in pending}:
+            cursor.execute('''
+            DELETE FROM stage_timings
+            WHERE stage = ? AND id <= (
+                SELECT id FROM stage_timings
+                WHERE stage = ?
+                ORDER BY id DESC
+                LIMIT 1 OFFSET ?
+            )
+            ''', (stage, stage, STAGE_TIMING_WINDOW))
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при сохранении длительности этапов: {str(e)}")
+    finally:
+        conn.close()
+
+def get_stage_timeout(stage):
+    """Таймаут этапа: p99 недавних успешных ожиданий × запас, в пределах floor/ceiling.
+    
+    Пока замеров мало, используется значение по умолчанию.
+    """
+    bounds = STAGE_TIMEOUTS[stage]
+    with _stage_timings_lock:
+        durations = list(STAGE_TIMINGS.get(stage, ()))
+    
+    if len(durations) < STAGE_TIMING_MIN_SAMPLES:
+        return bounds['default']
+    
+    timeout = percentile(durations, 99) * STAGE_TIMEOUT_FACTOR
+    return min(bounds['ceiling'], max(bounds['floor'], timeout))
+
+def wait_for_stage(driver, stage, condition, record=True):
+    """WebDriverWait с адаптивным таймаутом этапа.
+    
+    Успешное ожидание записывается, если record: повторные поиски на уже
+    загруженной странице занимают ~0 с и занизили бы таймаут этапа.
+    """
+    started = time.monotonic()
+    try:
+        result = WebDriverWait(driver, get_stage_timeout(stage)).until(condition)
+    except TimeoutException as e:
+        raise StageTimeoutError(stage) from e
+    if record:
+        record_stage_duration(stage, time.monotonic() - started)
+    return result
+
+class StageTimeoutError(Exception):
+    """Этап Selenium не дождался нужного состояния страницы"""
+    
+    def __init__(self, stage):
+        super().__init__(f"Таймаут этапа {stage}")
+        self.stage = stage
+
+def classify_failure(error) -> str:
+    """Причина сбоя анализа для автоматического выключателя"""
+    if isinstance(error, StageTimeoutError):
+        if error.stage == 'results':
+            return 'result_timeout'
+        if error.stage.startswith('login'):
+            return 'login_failed'
+        return 'selector_missing'
+    if NoSuchElementException is not None and isinstance(error, NoSuchElementException):
+        return 'selector_missing'
+    if WebDriverException is not None and isinstance(error, WebDriverException):
+        return 'browser_error'
+    return 'other'
+
+class CircuitBreaker:
+    """Автоматический выключатель для сервиса анализа videohunt.ai.
+    
+    closed - задачи идут как обычно, сбои сервиса считаются в скользящем окне.
+    open - новые задачи сразу отклоняются, браузеры не запускаются.
+    half_open - по истечении паузы пропускаются пробные задачи; после
+    нескольких успешных выключатель закрывается, при сбое снова открывается.
+    Локальные сбои (браузер, прочее) на состояние не влияют.
+    """
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    SERVICE_CAUSES = ('login_failed', 'selector_missing', 'result_timeout')
+    
+    def __init__(self):
+        self.state = self.CLOSED
+        self.outcomes = deque()
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self.probe_successes = 0
+        self.on_change = None
+    
+    def allow(self):
+        """Можно ли запускать задачу. Возвращает (разрешено, пробная ли задача)"""
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= BREAKER_OPEN_SECONDS:
+            self._set_state(self.HALF_OPEN, "пауза истекла, пробуем пробные задачи")
+        
+        if self.state == self.CLOSED:
+            return True, False
+        if self.state == self.HALF_OPEN and self.probes_in_flight < BREAKER_HALF_OPEN_PROBES:
+            self.probes_in_flight += 1
+            return True, True
+        return False, False
+    
+    def record(self, success, cause=None, probe=False):
+        """Учитывает результат задачи"""
+        if probe:
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+        if not success and cause not in self.SERVICE_CAUSES:
+            return
+        
+        if probe and self.state == self.HALF_OPEN:
+            if not success:
+                self._open(f"пробная задача не прошла ({cause})")
+                return
+            self.probe_successes += 1
+            if self.probe_successes >= BREAKER_PROBES_TO_CLOSE:
+                self.outcomes.clear()
+                self._set_state(self.CLOSED, "пробные задачи прошли успешно")
+            return
+        
+        now = time.monotonic()
+        self.outcomes.append((now, cause if not success else None))
+        self._prune(now)
+        
+        if self.state == self.CLOSED and not success:
+            failures = self.failure_counts()
+            total_failures = sum(failures.values())
+            if (total_failures >= BREAKER_MIN_FAILURES
+                    and total_failures / len(self.outcomes) >= BREAKER_FAILURE_RATE):
+                details = ", ".join(f"{name}: {count}" for name, count in failures.items())
+                self._open(f"{total_failures} сбоев из {len(self.outcomes)} ({details})")
+    
+    def failure_counts(self):
+        """Сбои по причинам в текущем окне"""
+        self._prune(time.monotonic())
+        counts = {}
+        for _, cause in self.outcomes:
+            if cause:
+                counts[cause] = counts.get(cause, 0) + 1
+        return counts
+    
+    def retry_after(self):
+        """Через сколько секунд будет пробная попытка"""
+        return max(0, int(self.opened_at + BREAKER_OPEN_SECONDS - time.monotonic()))
+    
+    def reset(self):
+        """Принудительно закрывает выключатель"""
+        self.outcomes.clear()
+        self.probes_in_flight = 0
+        self._set_state(self.CLOSED, "сброшен администратором")
+    
+    def _open(self, reason):
+        self.opened_at = time.monotonic()
+        self._set_state(self.OPEN, reason)
+    
+    def _prune(self, now):
+        while self.outcomes and now - self.outcomes[0][0] > BREAKER_WINDOW:
+            self.outcomes.popleft()
+    
+    def _set_state(self, state, reason):
+        if state == self.state:
+            return
+        previous, self.state = self.state, state
+        self.probe_successes = 0
+        logger.warning(f"Выключатель анализа: {previous} -> {state} ({reason})")
+        if self.on_change:
+            self.on_change(previous, state, reason)
+
+ANALYSIS_BREAKER = CircuitBreaker()
+
+class JobScheduler:
+    """Очередь задач анализа с приоритетом для премиум-подписчиков.
+    
+    Одновременно выполняется не больше MAX_CONCURRENT_JOBS задач.
+    PREMIUM_RESERVED_SLOTS из них зарезервированы за премиум: бесплатные
+    задачи занимают резерв только когда премиум-задач в очереди нет.
+    Бесплатная задача, ждущая дольше QUEUE_AGING_SECONDS, встает в очередь
+    наравне с премиум, чтобы не голодать, но резерв по-прежнему не занимает.
+    
+    Спекулятивные слоты (предзагрузка страницы) вытесняемы: если задача в очереди
+    не может стартовать, вызывается preempt(), который должен освободить один такой
+    слот и вернуть True.
+    """
+    
+    def __init__(self):
+        self.waiting = []
+        self.running = {'free': 0, 'premium': 0}
+        self.wait_times = {'free': deque(maxlen=500), 'premium': deque(maxlen=500)}
+        self.preempt = None
+        self.preempted = 0  # вытесненные слоты, которые еще не освобождены
+    
+    @contextlib.asynccontextmanager
+    async def slot(self, tier):
+        """Ждет свободный слот для задачи указанного тарифа"""
+        tier = 'premium' if tier == 'premium' else 'free'
+        waiter = {
+            'tier': tier,
+            'enqueued': time.monotonic(),
+            'future': asyncio.get_running_loop().create_future()
+        }
+        self.waiting.append(waiter)
+        self._dispatch()
+        try:
+            await waiter['future']
+        except asyncio.CancelledError:
+            if waiter in self.waiting:
+                self.waiting.remove(waiter)
+            elif waiter['future'].done() and not waiter['future'].cancelled():
+                # Слот уже выдан - возвращаем его
+                self.release(tier)
+            raise
+        
+        async with self.held(tier):
+            yield
+    
+    @contextlib.asynccontextmanager
+    async def held(self, tier):
+        """Освобождает уже занятый слот по завершении блока"""
+        try:
+            yield
+        finally:
+            self.release(tier)
+    
+    def try_acquire(self, tier) -> bool:
+        """Занимает спекулятивный слот без ожидания, если он свободен и очереди нет.
+        
+        Бесплатный тариф не занимает премиум-резерв даже когда тот простаивает.
+        """
+        tier = 'premium' if tier == 'premium' else 'free'
+        if self.waiting or not self._can_start(tier):
+            return False
+        if tier == 'free' and self.running['free'] >= MAX_CONCURRENT_JOBS - PREMIUM_RESERVED_SLOTS:
+            return False
+        self.running[tier] += 1
+        return True
+    
+    def release(self, tier, preempted=False):
+        """Освобождает слот и передает его следующей задаче"""
+        tier = 'premium' if tier == 'premium' else 'free'
+        self.running[tier] -= 1
+        if preempted:
+            self.preempted -= 1
+        self._dispatch()
+    
+    def has_free_slot(self, tier) -> bool:
+        """Получит ли задача тарифа слот сразу, без ожидания в очереди"""
+        return not self.waiting and self._can_start(tier)
+    
+    def _is_priority(self, waiter, now):
+        return waiter['tier'] == 'premium' or now - waiter['enqueued'] >= QUEUE_AGING_SECONDS
+    
+    def _can_start(self, tier):
+        """Можно ли сейчас запустить задачу тарифа"""
+        if sum(self.running.values()) >= MAX_CONCURRENT_JOBS:
+            return False
+        if tier == 'premium':
+            return True
+        # Сверх общей доли бесплатные задачи занимают резерв, только если
+        # он простаивает: премиум-задачи не выполняются и не ждут.
+        # Давность ожидания на это не влияет - она меняет только порядок очереди
+        within_share = self.running['free'] < MAX_CONCURRENT_JOBS - PREMIUM_RESERVED_SLOTS
+        premium_idle = self.running['premium'] == 0 and not any(
+            waiter['tier'] == 'premium' for waiter in self.waiting)
+        return within_share or premium_idle
+    
+    def _dispatch(self):
+        """Выдает освободившиеся слоты ожидающим задачам в порядке приоритета"""
+        now = time.monotonic()
+        self.waiting.sort(key=lambda waiter: (not self._is_priority(waiter, now), waiter['enqueued']))
+        
+        # Дождавшаяся бесплатная задача может стоять впереди премиум, но не может
+        # занять резерв - тогда слот резерва достается первой премиум-задаче за ней
+        while True:
+            waiter = next((waiter for waiter in self.waiting if self._can_start(waiter['tier'])), None)
+            if waiter is None:
+                break
+            self.waiting.remove(waiter)
+            self.running[waiter['tier']] += 1
+            self.wait_times[waiter['tier']].append(now - waiter['enqueued'])
+            waiter['future'].set_result(None)
+        
+        # Задачи ждут - вытесняем предзагрузки, но не больше, чем задач в очереди
+        while self.waiting and self.preempt and self.preempted < len(self.waiting):
+            if not self.preempt():
+                break
+            self.preempted += 1
+    
+    def queue_lengths(self):
+        """Сколько задач каждого тарифа ждет в очереди"""
+        lengths = {'free': 0, 'premium': 0}
+        for waiter in self.waiting:
+            lengths[waiter['tier']] += 1
+        return lengths
+    
+    def wait_stats(self, tier):
+        """p50/p95/max ожидания в очереди для тарифа, секунд"""
+        waits = list(self.wait_times[tier])
+        return {
+            'count': len(waits),
+            'p50': percentile(waits, 50),
+            'p95': percentile(waits, 95),
+            'max': max(waits, default=0.0)
+        }
+
+JOB_SCHEDULER = JobScheduler()
+
+def preload_video_page(owner, video_url):
+    """Готовит авторизованный браузер с открытой страницей видео (в рабочем потоке)"""
+    session = None
+    started = time.monotonic()
+    try:
+        session = open_job_session(owner, 'speculative')
+        if session is None:
+            return None
+        open_video_page(session['driver'], video_url)
+        session['preload_seconds'] = time.monotonic() - started
+        # Сессия остается занятой: иначе очистка по лимиту памяти может закрыть
+        # браузер, который вот-вот получит промт
+        touch_browser_session(session)
+        return session
+    except Exception as e:
+        logger.error(f"Ошибка при предзагрузке страницы видео: {str(e)}")
+        release_job_session(session)
+        return None
+
+def start_speculation(user_id, video_url):
+    """Начинает предзагрузку страницы видео сразу после того, как ссылка принята.
+    
+    Предзагрузка занимает слот очереди, только если он свободен прямо сейчас,
+    и уступает его, как только в очереди появляется задача (preempt_speculation).
+    """
+    if not SPECULATIVE_PRELOAD or ANALYSIS_BREAKER.state != CircuitBreaker.CLOSED:
+        return
+    cancel_speculation(user_id, 'cancelled')
+    
+    tier = get_user_tier(user_id)
+    if not JOB_SCHEDULER.try_acquire(tier):
+        return
+    
+    loop = asyncio.get_running_loop()
+    speculation = {
+        'url': video_url,
+        'tier': tier,
+        'started': time.monotonic(),
+        'task': loop.run_in_executor(None, preload_video_page, user_id, video_url)
+    }
+    speculation['timeout'] = loop.call_later(
+        SPECULATION_TIMEOUT, cancel_speculation, user_id, 'expired', speculation)
+    SPECULATIONS[user_id] = speculation
+    SPECULATION_STATS['started'] += 1
+
+def cancel_speculation(user_id, reason, expected=None):
+    """Отменяет предзагрузку: браузер закрывается, слот очереди освобождается"""
+    speculation = SPECULATIONS.get(user_id)
+    if speculation is None or (expected is not None and speculation is not expected):
+        return
+    del SPECULATIONS[user_id]
+    speculation['timeout'].cancel()
+    SPECULATION_STATS[reason] += 1
+    
+    def cleanup(future):
+        session = None if future.cancelled() or future.exception() else future.result()
+        SPECULATION_STATS['wasted_seconds'] += time.monotonic() - speculation['started']
+        if session:
+            asyncio.get_running_loop().run_in_executor(None, release_job_session, session)
+        JOB_SCHEDULER.release(speculation['tier'], preempted=reason == 'preempted')
+    
+    # Если предзагрузка еще идет, браузер закроется, когда она закончится
+    speculation['task'].add_done_callback(cleanup)
+
+def preempt_speculation():
+    """Отменяет самую давнюю предзагрузку, чтобы отдать ее слот задаче из очереди"""
+    if not SPECULATIONS:
+        return False
+    user_id = min(SPECULATIONS, key=lambda user_id: SPECULATIONS[user_id]['started'])
+    cancel_speculation(user_id, 'preempted')
+    return True
+
+JOB_SCHEDULER.preempt = preempt_speculation
+
+async def take_speculation(user_id, video_url):
+    """Забирает готовую предзагрузку для ссылки.
+    
+    Возвращает (сессия, тариф) - слот очереди остается занятым за задачей -
+    или (None, None), если предзагрузки нет или она не удалась.
+    """
+    speculation = SPECULATIONS.get(user_id)
+    if speculation is None:
+        return None, None
+    if speculation['url'] != video_url:
+        cancel_speculation(user_id, 'cancelled')
+        return None, None
+    
+    del SPECULATIONS[user_id]
+    speculation['timeout'].cancel()
+    
+    session = await speculation['task']
+    if session is None:
+        SPECULATION_STATS['failed'] += 1
+        JOB_SCHEDULER.release(speculation['tier'])
+        return None, None
+    
+    SPECULATION_STATS['hits'] += 1
+    SPECULATION_STATS['saved_seconds'] += session.get('preload_seconds', 0.0)
+    return session, speculation['tier']
+
+async def notify_admins(bot, text):
+    """Отправляет сообщение всем администраторам"""
+    for admin_id in ADMIN_IDS:
+        try:
+            await bot.send_message(chat_id=admin_id, text=text)
+        except Exception as e:
+            logger.error(f"Ошибка при уведомлении администратора {admin_id}: {str(e)}")
+
+def breaker_unavailable_text():
+    """Сообщение пользователю, пока выключатель открыт"""
+    return (
+        "⚠️ Сервис анализа видео сейчас недоступен.\n"
+        f"Попробуйте через {max(1, ANALYSIS_BREAKER.retry_after() // 60 + 1)} мин. "
+        "Запрос не был списан с вашего лимита."
+    )
 
 def login_with_selenium(driver, email, password):
-    """Авторизация на сайте через Selenium"""
+    """Авторизация на сайте через Selenium.
+    
+    False - сайт не пустил (форма или переход не дождались). Сбои самого
+    браузера пробрасываются, чтобы classify_failure отнес их к browser_error.
+    """
     try:
         logger.info("Opening login page...")
         driver.get("https://videohunt.ai/login")
         time.sleep(2)
 
         logger.info("Entering email...")
-        email_field = WebDriverWait(driver, 15).until(
+        email_field = wait_for_stage(driver, 'login_fields',
             EC.element_to_be_clickable((By.ID, "basic_email_login"))
         )
         email_field.clear()
         email_field.send_keys(email)
         
         logger.info("Entering password...")
-        password_field = WebDriverWait(driver, 15).until(
-            EC.element_to_be_clickable((By.CSS_SELECTOR, "input.vh-input[type='password']"))
+        # Форма уже загружена: повторные поиски не пишутся в статистику этапа
+        password_field = wait_for_stage(driver, 'login_fields',
+            EC.element_to_be_clickable((By.CSS_SELECTOR, "input.vh-input[type='password']")),
+            record=False
         )
         password_field.clear()
         password_field.send_keys(password)
         
         logger.info("Clicking login button...")
-        login_button = WebDriverWait(driver, 15).until(
-            EC.element_to_be_clickable((By.CSS_SELECTOR, "button[type='submit'].vh-btn-primary"))
+        login_button = wait_for_stage(driver, 'login_fields',
+            EC.element_to_be_clickable((By.CSS_SELECTOR, "button[type='submit'].vh-btn-primary")),
+            record=False
         )
         login_button.click()
         time.sleep(5)
         
-        WebDriverWait(driver, 30).until(
+        wait_for_stage(driver, 'login_redirect',
             lambda d: d.current_url != "https://videohunt.ai/login"
         )
         logger.info("Successfully logged in!")
         return True
         
-    except Exception as e:
+    except (StageTimeoutError, NoSuchElementException) as e:
         logger.error(f"Login error: {str(e)}")
         return False
 
-def process_video_selenium(driver, video_url, prompt):
-    """Обработка видео через Selenium"""
-    try:
-        encoded_url = urllib.parse.quote(video_url)
-        target_url = f"https://videohunt.ai/video/result?url={encoded_url}&input_t=URL"
-        logger.info(f"Navigating to video page: {target_url}")
-        
-        driver.get(target_url)
-        WebDriverWait(driver, 30).until(
-            EC.presence_of_element_located((By.TAG_NAME, "body"))
-        )
-        time.sleep(2)
-        
-        logger.info("Entering prompt...")
-        input_field = WebDriverWait(driver, 30).until(
-            EC.element_to_be_clickable((By.CSS_SELECTOR, "input.vh-input"))
-        )
-        input_field.clear()
-        input_field.send_keys(prompt)
-        time.sleep(1)
-        
-        logger.info("Clicking Find button...")
-        find_button = WebDriverWait(driver, 30).until(
-            EC.element_to_be_clickable((By.CSS_SELECTOR, "button.search-button"))
-        )
-        find_button.click()
-        
-        # Ждем изменения URL или появления результата
-        WebDriverWait(driver, 120).until(
-            lambda d: "hmtask" in d.current_url or "moments" in d.current_url
-        )
-        
-        # Получаем текущий URL
-        results_url = driver.current_url
-        logger.info(f"Final results URL: {results_url}")
-        
-        if "hmtask" not in results_url and "moments" not in results_url:
-            return False, None
-        
-        return True, {
-            "results_page": results_url,
-            "login_credentials": {
-                "email": ACCOUNT_EMAIL,
-                "password": ACCOUNT_PASSWORD
-            }
-        }
+def get_video_page_url(video_url: str) -> str:
+    """Адрес страницы анализа видео на videohunt.ai"""
+    encoded_url = urllib.parse.quote(video_url)
+    return f"https://videohunt.ai/video/result?url={encoded_url}&input_t=URL"
+
+def open_video_page(driver, video_url):
+    """Открывает страницу видео и ждет поле ввода промта"""
+    target_url = get_video_page_url(video_url)
+    logger.info(f"Navigating to video page: {target_url}")
+    
+    driver.get(target_url)
+    wait_for_stage(driver, 'page_load',
+        EC.presence_of_element_located((By.TAG_NAME, "body")),
+        record=False
+    )
+    time.sleep(2)
+    
+    # Длительность загрузки страницы - ожидание поля ввода промта
+    wait_for_stage(driver, 'page_load',
+        EC.element_to_be_clickable((By.CSS_SELECTOR, "input.vh-input"))
+    )
+
+def submit_prompt(driver, prompt):
+    """Отправляет промт на уже открытой странице видео и возвращает ссылку на результаты"""
+    previous_url = driver.current_url
+    
+    logger.info("Entering prompt...")
+    # Страница уже загружена: поиск элементов не пишется в статистику этапа
+    input_field = wait_for_stage(driver, 'page_load',
+        EC.element_to_be_clickable((By.CSS_SELECTOR, "input.vh-input")),
+        record=False
+    )
+    # clear() не всегда сбрасывает поле после предыдущего промта - выделяем и стираем
+    input_field.clear()
+    input_field.send_keys(Keys.CONTROL, 'a')
+    input_field.send_keys(Keys.DELETE)
+    input_field.send_keys(prompt)
+    time.sleep(1)
+    
+    logger.info("Clicking Find button...")
+    find_button = wait_for_stage(driver, 'page_load',
+        EC.element_to_be_clickable((By.CSS_SELECTOR, "button.search-button")),
+        record=False
+    )
+    find_button.click()
+    
+    # Ждем появления новой ссылки на результаты
+    wait_for_stage(driver, 'results',
+        lambda d: d.current_url != previous_url
+        and ("hmtask" in d.current_url or "moments" in d.current_url)
+    )
+    
+    results_url = driver.current_url
+    logger.info(f"Final results URL: {results_url}")
+    return results_url
+
+def process_video_prompts_selenium(driver, video_url, prompts, page_loaded=False, on_stage=None):
+    """Обрабатывает несколько промтов на одной загруженной странице видео.
+    
+    Возвращает список (успех, ссылка на результаты, причина ошибки) - по одному на промт.
+    """
+    results = []
+    for number, prompt in enumerate(prompts, start=1):
+        if on_stage:
+            on_stage('analyzing', number, len(prompts))
+        try:
+            # Страница перезагружается только если на ней нет поля ввода
+            if page_loaded and not driver.find_elements(By.CSS_SELECTOR, "input.vh-input"):
+                page_loaded = False
+            if not page_loaded:
+                open_video_page(driver, video_url)
+                page_loaded = True
             
-    except Exception as e:
-        logger.error(f"Error processing video: {str(e)}")
-        return False, None
+            results.append((True, submit_prompt(driver, prompt), None))
+        except Exception as e:
+            logger.error(f"Error processing video: {str(e)}")
+            results.append((False, None, classify_failure(e)))
+            page_loaded = False
+    return results
 
 async def handle_message(update: Update, context: CallbackContext) -> None:
     """Обрабатывает сообщения пользователя"""
     user = update.effective_user
     text = update.message.text.strip()
     
-    if context.user_data.get('awaiting_video_url'):
+    if context.user_data.get('awaiting_batch'):
+        await run_batch(update, context, text)
+    
+    elif context.user_data.get('awaiting_video_url'):
         if is_valid_url(text):
             clean_url = clean_video_url(text)
             if 'youtube.com' in clean_url or 'youtu.be' in clean_url:
                 context.user_data['video_url'] = clean_url
                 context.user_data['awaiting_video_url'] = False
                 context.user_data['awaiting_prompt'] = True
-                await update.message.reply_text("✅ Ссылка принята. Теперь отправьте промт:")
+                # Пока пользователь пишет промт, готовим браузер и страницу видео
+                start_speculation(user.id, clean_url)
+                await update.message.reply_text(
+                    "✅ Ссылка принята. Теперь отправьте промт.\n"
+                    "Несколько вопросов к видео - каждый с новой строки."
+                )
             else:
                 await update.message.reply_text("❌ Пожалуйста, отправьте ссылку на YouTube.")
         else:
             await update.message.reply_text("❌ Некорректная ссылка. Попробуйте еще раз.")
     
     elif context.user_data.get('awaiting_prompt'):
-        prompt = text
+        # Каждая строка - отдельный промт к одному и тому же видео
+        prompts = [line.strip() for line in text.splitlines() if line.strip()]
+        if len(prompts) > MAX_PROMPTS_PER_VIDEO:
+            await update.message.reply_text(f"❌ Можно отправить не более {MAX_PROMPTS_PER_VIDEO} промтов за раз.")
+            return
+        
+        max_requests, used = get_request_quota(user.id)
+        if used + len(prompts) > max_requests:
+            await update.message.reply_text(
+                f"❌ Осталось запросов сегодня: {max(max_requests - used, 0)} из {max_requests}.\n"
+                "Отправьте меньше промтов или используйте /buy для покупки подписки."
+            )
+            return
+        
         video_url = context.user_data['video_url']
         
         # Запускаем обработку видео в фоне
-        asyncio.create_task(process_video_async(update, context, video_url, prompt))
+        asyncio.create_task(process_video_async(update, context, video_url, prompts))
         
         # Очищаем контекст
         if 'video_url' in context.user_data:
@@ -658,6 +2558,12 @@ async def admin_panel(update: Update, context: CallbackContext):
         "/set_price - Изменить цену подписки\n"
         "/broadcast - Сделать рассылку\n"
         "/change_videohunt_password - Изменить пароль аккаунта videohunt.ai\n"
+        "/browsers - Браузерные сессии\n"
+        "/monitor - Мониторинг цикла событий (on/off/report/reset)\n"
+        "/timeouts - Адаптивные таймауты Selenium\n"
+        "/breaker - Состояние выключателя сервиса анализа\n"
+        "/queue - Очередь задач и ожидание по тарифам\n"
+        "/speculation - Статистика предзагрузки страниц видео\n"
     )
     
     await update.message.reply_text(text)
@@ -701,21 +2607,14 @@ async def handle_password_change(update: Update, context: CallbackContext):
 
 async def process_password_change(update: Update, context: CallbackContext, new_password: str):
     """Процесс изменения пароля через Selenium"""
-    driver = None
+    session = None
+    waiting_for_code = False
     try:
         # Инициализация браузера
-        service = Service(executable_path=CHROME_DRIVER_PATH)
-        options = webdriver.ChromeOptions()
-        
-        options.add_argument("--start-maximized")
-        options.add_argument("--disable-blink-features=AutomationControlled")
-        options.add_argument("--ignore-certificate-errors")
-        options.add_argument("--disable-dev-shm-usage")
-        options.add_argument("--no-sandbox")
-        options.add_experimental_option("excludeSwitches", ["enable-automation"])
-        options.add_experimental_option('useAutomationExtension', False)
-        
-        driver = webdriver.Chrome(service=service, options=options)
+        session = await asyncio.get_event_loop().run_in_executor(
+            None,
+            lambda: open_browser_session(update.effective_user.id, 'password_change'))
+        driver = session['driver']
         
         # Логинимся в аккаунт
         if not login_with_selenium(driver, ACCOUNT_EMAIL, ACCOUNT_PASSWORD):
@@ -754,21 +2653,28 @@ async def process_password_change(update: Update, context: CallbackContext, new_
         
         await update.message.reply_text("✅ Код подтверждения отправлен. Пожалуйста, введите код из письма:")
         
-        # Сохраняем драйвер в контексте для последующего использования
-        context.user_data['selenium_driver'] = driver
+        # Сохраняем сессию для последующего использования; пока ждем код,
+        # браузер простаивает и будет закрыт по таймауту, если ответа не будет
+        touch_browser_session(session, busy=False)
+        context.user_data['browser_session_id'] = session['id']
+        waiting_for_code = True
         
     except Exception as e:
         logger.error(f"Ошибка при изменении пароля: {str(e)}")
         await update.message.reply_text("❌ Произошла ошибка при изменении пароля")
-        if driver:
-            driver.quit()
+    finally:
+        # Браузер нужен дальше, только если ждем код подтверждения
+        if not waiting_for_code:
+            close_browser_session(session)
 
 async def complete_password_change(update: Update, context: CallbackContext, verification_code: str):
     """Завершение процесса изменения пароля с кодом подтверждения"""
-    driver = context.user_data.get('selenium_driver')
-    if not driver:
-        await update.message.reply_text("❌ Ошибка: сессия браузера не найдена")
+    session = get_browser_session(context.user_data.pop('browser_session_id', None))
+    if not session:
+        await update.message.reply_text("❌ Ошибка: сессия браузера не найдена или закрыта по таймауту")
         return
+    touch_browser_session(session, busy=True)
+    driver = session['driver']
     
     try:
         # Вводим код подтверждения
@@ -795,13 +2701,182 @@ async def complete_password_change(update: Update, context: CallbackContext, ver
         logger.error(f"Ошибка при подтверждении пароля: {str(e)}")
         await update.message.reply_text("❌ Произошла ошибка при подтверждении пароля")
     finally:
-        if driver:
-            driver.quit()
-        if 'selenium_driver' in context.user_data:
-            del context.user_data['selenium_driver']
+        close_browser_session(session)
         if 'new_password' in context.user_data:
             del context.user_data['new_password']
 
+async def admin_browsers(update: Update, context: CallbackContext):
+    """Показывает живые браузерные сессии"""
+    user = update.effective_user
+    
+    if user.id not in ADMIN_IDS:
+        await update.message.reply_text("❌ У вас нет доступа к этой команде.")
+        return
+    
+    loop = asyncio.get_running_loop()
+    if context.args and context.args[0] == 'reap':
+        result = await loop.run_in_executor(None, reap_browser_sessions)
+        await update.message.reply_text(
+            f"🧹 Закрыто сессий: {result['sessions']}, убито процессов: {result['orphans']}"
+        )
+        return
+    
+    with _browser_sessions_lock:
+        sessions = list(BROWSER_SESSIONS.values())
+    
+    now = time.monotonic()
+    lines = ["🌐 Браузерные сессии:\n"]
+    for session in sessions:
+        memory = await loop.run_in_executor(
+            None, lambda: get_processes_memory_mb(get_process_tree(session['pid'])))
+        tabs = f", вкладок {len(session['tabs'])}/{TABS_PER_BROWSER}" if 'tabs' in session else ""
+        lines.append(
+            f"#{session['id']} {session['purpose']} (владелец: {session['owner']}) - "
+            f"{'занята' if session['busy'] else 'свободна'}{tabs}, "
+            f"возраст {int(now - session['created'])} с, "
+            f"простой {int(now - session['last_used'])} с, "
+            f"{memory:.0f} МБ"
+        )
+    if not sessions:
+        lines.append("Нет активных сессий")
+    
+    total_memory = await loop.run_in_executor(None, get_browsers_memory_mb)
+    orphans = await loop.run_in_executor(None, find_orphan_browser_processes)
+    lines.append(
+        f"\nВсего памяти: {total_memory:.0f} / {BROWSER_MEMORY_LIMIT_MB} МБ\n"
+        f"Осиротевших процессов: {len(orphans)}\n"
+        "/browsers reap - очистить сейчас"
+    )
+    if load_psutil() is None:
+        lines.append("⚠️ psutil не установлен: память и осиротевшие процессы не отслеживаются")
+    
+    await update.message.reply_text("\n".join(lines))
+
+async def admin_monitor(update: Update, context: CallbackContext):
+    """Управление мониторингом цикла событий"""
+    user = update.effective_user
+    
+    if user.id not in ADMIN_IDS:
+        await update.message.reply_text("❌ У вас нет доступа к этой команде.")
+        return
+    
+    action = context.args[0] if context.args else 'report'
+    if action == 'on':
+        LOOP_MONITOR.start()
+        await update.message.reply_text("✅ Мониторинг цикла событий включен")
+    elif action == 'off':
+        LOOP_MONITOR.stop()
+        await update.message.reply_text("✅ Мониторинг цикла событий выключен")
+    elif action == 'reset':
+        LOOP_MONITOR.reset()
+        await update.message.reply_text("✅ Статистика мониторинга сброшена")
+    elif action == 'report':
+        await update.message.reply_text(LOOP_MONITOR.report())
+    else:
+        await update.message.reply_text("Используйте: /monitor [on|off|report|reset]")
+
+async def admin_timeouts(update: Update, context: CallbackContext):
+    """Показывает адаптивные таймауты этапов Selenium"""
+    user = update.effective_user
+    
+    if user.id not in ADMIN_IDS:
+        await update.message.reply_text("❌ У вас нет доступа к этой команде.")
+        return
+    
+    lines = [f"⏱ Таймауты этапов (p99 × {STAGE_TIMEOUT_FACTOR:g}):\n"]
+    for stage, bounds in STAGE_TIMEOUTS.items():
+        with _stage_timings_lock:
+            durations = list(STAGE_TIMINGS.get(stage, ()))
+        source = "адаптивный" if len(durations) >= STAGE_TIMING_MIN_SAMPLES else "по умолчанию"
+        lines.append(
+            f"{stage}: {get_stage_timeout(stage):.1f} с ({source}; "
+            f"границы {bounds['floor']}-{bounds['ceiling']} с)\n"
+            f"  замеров {len(durations)}, p50 {percentile(durations, 50):.1f} с, "
+            f"p99 {percentile(durations, 99):.1f} с"
+        )
+    
+    await update.message.reply_text("\n".join(lines))
+
+async def admin_breaker(update: Update, context: CallbackContext):
+    """Показывает состояние выключателя сервиса анализа"""
+    user = update.effective_user
+    
+    if user.id not in ADMIN_IDS:
+        await update.message.reply_text("❌ У вас нет доступа к этой команде.")
+        return
+    
+    if context.args and context.args[0] == 'reset':
+        ANALYSIS_BREAKER.reset()
+        await update.message.reply_text("✅ Выключатель закрыт")
+        return
+    
+    failures = ANALYSIS_BREAKER.failure_counts()
+    text = (
+        f"🔌 Выключатель анализа: {BREAKER_STATE_NAMES[ANALYSIS_BREAKER.state]}\n"
+        f"За последние {BREAKER_WINDOW} с: задач {len(ANALYSIS_BREAKER.outcomes)}, "
+        f"сбоев {sum(failures.values())}\n"
+    )
+    for cause, count in failures.items():
+        text += f"- {cause}: {count}\n"
+    if ANALYSIS_BREAKER.state == CircuitBreaker.OPEN:
+        text += f"Пробная задача через {ANALYSIS_BREAKER.retry_after()} с\n"
+    text += (
+        f"\nПорог: {BREAKER_MIN_FAILURES} сбоев и не менее {BREAKER_FAILURE_RATE:.0%} задач\n"
+        "/breaker reset - закрыть вручную"
+    )
+    
+    await update.message.reply_text(text)
+
+async def admin_queue(update: Update, context: CallbackContext):
+    """Показывает очередь задач анализа и ожидание по тарифам"""
+    user = update.effective_user
+    
+    if user.id not in ADMIN_IDS:
+        await update.message.reply_text("❌ У вас нет доступа к этой команде.")
+        return
+    
+    lengths = JOB_SCHEDULER.queue_lengths()
+    text = (
+        f"🚦 Очередь анализа: слотов {MAX_CONCURRENT_JOBS}, "
+        f"из них резерв премиум {PREMIUM_RESERVED_SLOTS}\n\n"
+    )
+    for tier in ('premium', 'free'):
+        stats = JOB_SCHEDULER.wait_stats(tier)
+        text += (
+            f"{SUBSCRIPTION_TYPES[tier]['name']}: выполняется {JOB_SCHEDULER.running[tier]}, "
+            f"в очереди {lengths[tier]}\n"
+            f"  ожидание p50/p95/max: {stats['p50']:.1f} / {stats['p95']:.1f} / "
+            f"{stats['max']:.1f} с (задач: {stats['count']})\n"
+        )
+    text += f"\nБесплатные задачи догоняют премиум через {QUEUE_AGING_SECONDS} с ожидания"
+    
+    await update.message.reply_text(text)
+
+async def admin_speculation(update: Update, context: CallbackContext):
+    """Показывает статистику предзагрузки страниц видео"""
+    user = update.effective_user
+    
+    if user.id not in ADMIN_IDS:
+        await update.message.reply_text("❌ У вас нет доступа к этой команде.")
+        return
+    
+    stats = SPECULATION_STATS
+    hit_rate = stats['hits'] / stats['started'] if stats['started'] else 0.0
+    text = (
+        f"🔮 Предзагрузка: {'включена' if SPECULATIVE_PRELOAD else 'выключена'}\n\n"
+        f"Запущено: {stats['started']}, активно сейчас: {len(SPECULATIONS)}\n"
+        f"Попаданий: {stats['hits']} ({hit_rate:.0%})\n"
+        f"Истекло без промта: {stats['expired']}\n"
+        f"Уступили слот очереди: {stats['preempted']}\n"
+        f"Отменено: {stats['cancelled']}\n"
+        f"Не удалось: {stats['failed']}\n\n"
+        f"Сэкономлено на ожидании: {stats['saved_seconds']:.0f} с\n"
+        f"Впустую занято браузеров: {stats['wasted_seconds']:.0f} с\n"
+        f"Промт ждем до {SPECULATION_TIMEOUT} с"
+    )
+    
+    await update.message.reply_text(text)
+
 async def admin_stats(update: Update, context: CallbackContext):
     """Показывает статистику бота"""
     user = update.effective_user
@@ -817,7 +2892,7 @@ async def admin_stats(update: Update, context: CallbackContext):
         "📊 Статистика бота:\n\n"
         f"Количество пользователей: {stats['total_users']}\n"
         f"Пользователей с активной подпиской: {stats['premium_users']}\n"
-        f"Всего запросов: {stats['total_requests']}\n\n"
+        f"Всего запросов: {stats['total_requests']} (в архиве: {stats['archived_requests']})\n\n"
         "Текущие настройки:\n"
         f"- Цена подписки: {settings['subscription_price'] / 100:.2f} {SUBSCRIPTION_TYPES['premium']['currency']}\n"
         f"- Запросов/день (без подписки): {settings['free_daily_requests']}\n"
@@ -927,16 +3002,10 @@ async def broadcast(update: Update, context: CallbackContext):
     
     message = ' '.join(context.args)
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT user_id FROM users')
-    users = cursor.fetchall()
-    conn.close()
-    
     success = 0
     failed = 0
     
-    for (user_id,) in users:
+    for user_id in get_all_user_ids():
         try:
             await context.bot.send_message(
                 chat_id=user_id,
@@ -953,6 +3022,10 @@ async def broadcast(update: Update, context: CallbackContext):
         f"Не удалось отправить: {failed}"
     )
             
+def shorten_prompt(prompt: str, limit: int = 40) -> str:
+    """Сокращает промт для подписи кнопки"""
+    return prompt if len(prompt) <= limit else prompt[:limit - 1] + '…'
+
 def is_valid_url(url: str) -> bool:
     """Проверяет валидность URL"""
     parsed = urllib.parse.urlparse(url)
@@ -965,14 +3038,55 @@ def clean_video_url(url: str) -> str:
     return url
 
 
-def main() -> None:
-    """Запуск бота"""
-    init_db()
+async def mark_update_received(update: Update, context: CallbackContext) -> None:
+    """Запоминает начало обработки обновления, пока первый ответ не измерен"""
+    if 'first_response' not in STARTUP_METRICS:
+        _first_updates[update.update_id] = time.monotonic()
+
+async def mark_first_response(update: Update, context: CallbackContext) -> None:
+    """Фиксирует, за сколько бот обработал первое обновление после запуска"""
+    started = _first_updates.pop(update.update_id, None)
+    if started is not None and 'first_response' not in STARTUP_METRICS:
+        report_startup_metric('first_response', "Первое обновление после запуска обработано за",
+                              time.monotonic() - started)
+        _first_updates.clear()
+
+async def post_init(application: Application) -> None:
+    """Вызывается перед началом опроса Telegram"""
+    report_startup_metric('ready', "Бот готов принимать обновления")
+    
+    if LOOP_MONITOR_ENABLED:
+        LOOP_MONITOR.start()
+    
+    for coroutine in (browser_reaper_loop(), retention_loop()):
+        task = asyncio.create_task(coroutine)
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
     
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    if PREWARM_BROWSER:
+        # Не ждем: прогрев идет в фоне, пока бот уже отвечает
+        asyncio.get_running_loop().run_in_executor(None, prewarm_browser)
+
+async def post_shutdown(application: Application) -> None:
+    """Закрывает все браузеры и сохраняет замеры этапов при остановке бота"""
+    with _browser_sessions_lock:
+        sessions = list(BROWSER_SESSIONS.values())
+    for session in sessions:
+        await asyncio.get_running_loop().run_in_executor(None, close_browser_session, session)
+    flush_stage_timings()
+
+def build_application(builder=None) -> Application:
+    """Создает приложение со всеми обработчиками бота.
+    
+    builder позволяет подменить токен и транспорт (например, в нагрузочном тесте).
+    """
+    if builder is None:
+        builder = Application.builder().token(TELEGRAM_TOKEN)
+    application = builder.post_init(post_init).post_shutdown(post_shutdown).build()
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("video", video_command))
+    application.add_handler(CommandHandler("batch", batch_command))
     application.add_handler(CommandHandler("buy", buy_subscription))
     application.add_handler(CommandHandler("admin", admin_panel))
     
@@ -982,12 +3096,48 @@ def main() -> None:
     application.add_handler(CommandHandler("set_price", set_price))
     application.add_handler(CommandHandler("broadcast", broadcast))
     application.add_handler(CommandHandler("change_videohunt_password", change_videohunt_password))
+    application.add_handler(CommandHandler("browsers", admin_browsers))
+    application.add_handler(CommandHandler("monitor", admin_monitor))
+    application.add_handler(CommandHandler("timeouts", admin_timeouts))
+    application.add_handler(CommandHandler("breaker", admin_breaker))
+    application.add_handler(CommandHandler("queue", admin_queue))
+    application.add_handler(CommandHandler("speculation", admin_speculation))
     
     application.add_handler(PreCheckoutQueryHandler(precheckout_callback))
     application.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, successful_payment_callback))
     
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application.add_handler(MessageHandler(filters.Document.TXT, handle_batch_file))
+    
+    # Группа -1 выполняется до основных обработчиков, группа 1 - после ответа:
+    # между ними - время обработки первого обновления
+    application.add_handler(TypeHandler(Update, mark_update_received), group=-1)
+    application.add_handler(TypeHandler(Update, mark_first_response), group=1)
+    
+    # Администраторы узнают о каждой смене состояния выключателя
+    def on_breaker_change(previous, state, reason):
+        asyncio.get_running_loop().create_task(notify_admins(
+            application.bot,
+            f"🔌 Выключатель анализа: {BREAKER_STATE_NAMES[state]}\nПричина: {reason}"
+        ))
+    ANALYSIS_BREAKER.on_change = on_breaker_change
+    
+    # Учет времени обработчиков (работает, когда мониторинг включен)
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = LOOP_MONITOR.wrap(handler.callback)
+    
+    return application
 
+def main() -> None:
+    """Запуск бота"""
+    report_startup_metric('imports', "Модули загружены")
+    
+    init_db()
+    load_stage_timings()
+    report_startup_metric('init_db', "База данных инициализирована")
+    
+    application = build_application()
     application.run_polling()
 
 if __name__ == '__main__':
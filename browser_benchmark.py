@@ -0,0 +1,176 @@
+"""Сравнение режимов браузеров: сколько задач анализа помещается в 1 ГБ памяти.
+
+Для каждого режима (BROWSER_MODE=process - свой Chrome на задачу,
+BROWSER_MODE=tabs - вкладки общего Chrome) одновременно запускаются --jobs
+задач: вход, открытие страницы видео и, если задан --prompt, отправка промта.
+Пока задачи держат страницы открытыми, замеряется суммарная память процессов
+браузеров.
+
+Нужны Chrome, chromedriver, psutil и учетные данные videohunt.ai из .env.
+
+Пример:
+    python browser_benchmark.py --jobs 8 --video-url https://www.youtube.com/watch?v=... --json report.json
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Токен боту не нужен: Telegram в замере не участвует
+os.environ.setdefault('TELEGRAM_TOKEN', '123456:BENCHMARK')
+
+import bot
+
+logger = logging.getLogger('browser_benchmark')
+
+
+class MemorySampler:
+    """Фоновый замер памяти браузеров и числа задач с открытой страницей"""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.samples = []
+        self.ready = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def job_ready(self, delta):
+        with self.lock:
+            self.ready += delta
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            memory = bot.get_browsers_memory_mb()
+            with self.lock:
+                self.samples.append((self.ready, memory))
+
+    def peak(self):
+        """(число задач, память) в момент, когда открыто больше всего страниц"""
+        if not self.samples:
+            return 0, 0.0
+        most_ready = max(ready for ready, _ in self.samples)
+        return most_ready, max(memory for ready, memory in self.samples if ready == most_ready)
+
+
+def run_job(args, sampler):
+    """Одна задача: сессия, страница видео, промт и удержание страницы"""
+    session = None
+    started = time.monotonic()
+    try:
+        session = bot.open_job_session(None, 'benchmark')
+        if session is None:
+            return {'success': False, 'error': 'Ошибка авторизации'}
+        bot.open_video_page(session['driver'], args.video_url)
+        if args.prompt:
+            bot.submit_prompt(session['driver'], args.prompt)
+        ready_seconds = time.monotonic() - started
+
+        sampler.job_ready(1)
+        try:
+            time.sleep(args.hold)
+        finally:
+            sampler.job_ready(-1)
+        return {'success': True, 'ready_s': ready_seconds}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+    finally:
+        bot.release_job_session(session)
+
+
+def close_all_browsers():
+    """Закрывает браузеры, оставшиеся после режима (например, свободные общие)"""
+    with bot._browser_sessions_lock:
+        sessions = list(bot.BROWSER_SESSIONS.values())
+    for session in sessions:
+        bot.close_browser_session(session)
+
+
+def run_mode(mode, args):
+    """Замер одного режима браузеров"""
+    bot.BROWSER_MODE = mode
+    sampler = MemorySampler()
+    sampler.start()
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        results = list(executor.map(lambda _: run_job(args, sampler), range(args.jobs)))
+    elapsed = time.monotonic() - started
+    sampler.stop()
+    close_all_browsers()
+
+    concurrent, memory = sampler.peak()
+    per_job = memory / concurrent if concurrent else None
+    ready = sorted(result['ready_s'] for result in results if result['success'])
+    return {
+        'mode': mode,
+        'jobs': args.jobs,
+        'succeeded': len(ready),
+        'errors': [result['error'] for result in results if not result['success']][:10],
+        'concurrent_jobs': concurrent,
+        'peak_memory_mb': round(memory, 1),
+        'mb_per_job': round(per_job, 1) if per_job else None,
+        'jobs_per_gb': round(1024 / per_job, 2) if per_job else None,
+        'ready_p50_s': round(bot.percentile(ready, 50), 2),
+        'ready_max_s': round(ready[-1], 2) if ready else 0.0,
+        'duration_s': round(elapsed, 1)
+    }
+
+
+def print_report(report):
+    """Печатает отчет в читаемом виде"""
+    print(f"Задач на режим: {report['jobs']}, вкладок на браузер: {report['tabs_per_browser']}")
+    print(f"{'режим':<10}{'успешно':>9}{'парал.':>8}{'память, МБ':>12}{'МБ/задачу':>11}"
+          f"{'задач/ГБ':>10}{'готово p50, с':>15}")
+    for mode in report['modes']:
+        print(f"{mode['mode']:<10}{mode['succeeded']:>9}{mode['concurrent_jobs']:>8}"
+              f"{mode['peak_memory_mb']:>12}{str(mode['mb_per_job']):>11}"
+              f"{str(mode['jobs_per_gb']):>10}{mode['ready_p50_s']:>15}")
+        for error in mode['errors']:
+            print(f"  ошибка: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Память браузеров: свой Chrome на задачу против вкладок')
+    parser.add_argument('--video-url', required=True, help='ссылка на видео для анализа')
+    parser.add_argument('--prompt', help='промт; без него страница видео только открывается')
+    parser.add_argument('--jobs', type=int, default=6, help='сколько задач выполняется одновременно')
+    parser.add_argument('--tabs', type=int, default=bot.TABS_PER_BROWSER, help='вкладок на общий браузер')
+    parser.add_argument('--hold', type=float, default=20.0, help='сколько держать страницу открытой, с')
+    parser.add_argument('--modes', default='process,tabs', help='режимы через запятую')
+    parser.add_argument('--json', help='сохранить отчет в JSON-файл')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    if bot.load_psutil() is None:
+        parser.error('нужен psutil: pip install psutil')
+
+    bot.TABS_PER_BROWSER = args.tabs
+    # Лимит памяти бота не должен отказывать в запуске браузеров во время замера
+    bot.BROWSER_MEMORY_LIMIT_MB = float('inf')
+
+    report = {
+        'jobs': args.jobs,
+        'tabs_per_browser': args.tabs,
+        'video_url': args.video_url,
+        'prompt': args.prompt,
+        'modes': [run_mode(mode.strip(), args) for mode in args.modes.split(',') if mode.strip()]
+    }
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,400 @@
+"""Нагрузочный тест функций базы данных на синтетических данных проектного объема.
+
+Во временной базе (схема - bot.init_db) создаются пользователи, история подписок
+и журнал запросов, затем замеряются функции бота из bot.py: время выполнения
+под одним потоком и под параллельной нагрузкой, а также планы их SQL-запросов
+(EXPLAIN QUERY PLAN). Запросы берутся из трассировки соединений, поэтому
+отчет следует за изменениями схемы и самих функций.
+
+Пример:
+    python db_benchmark.py --users 1000000 --requests 20000000 --json db_report.json
+    python db_benchmark.py --compare db_report.json   # сравнение с прошлым отчетом
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Токен боту не нужен: Telegram в замере не участвует
+os.environ.setdefault('TELEGRAM_TOKEN', '123456:BENCHMARK')
+
+import bot
+
+logger = logging.getLogger('db_benchmark')
+
+FIRST_USER_ID = 100_000_000
+INSERT_CHUNK = 100_000
+REQUEST_TYPE = 'video_analysis'
+PREMIUM_PERIOD = timedelta(days=30)
+
+
+def summarize(values):
+    """Сводка по выборке длительностей в миллисекундах"""
+    return {
+        'count': len(values),
+        'p50_ms': round(bot.percentile(values, 50) * 1000, 3),
+        'p95_ms': round(bot.percentile(values, 95) * 1000, 3),
+        'p99_ms': round(bot.percentile(values, 99) * 1000, 3),
+        'max_ms': round(max(values) * 1000, 3) if values else 0.0
+    }
+
+
+def user_id_at(index):
+    """Идентификаторы идут с пропусками, как у настоящих пользователей Telegram"""
+    return FIRST_USER_ID + index * 7
+
+
+def pick_user(users):
+    """Активность пользователей неравномерна: первые пользователи делают больше запросов"""
+    return user_id_at(int(users * random.random() ** 3))
+
+
+def insert_chunks(conn, sql, rows, total, label):
+    """Вставляет строки пачками и пишет прогресс"""
+    chunk = []
+    inserted = 0
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= INSERT_CHUNK:
+            conn.executemany(sql, chunk)
+            inserted += len(chunk)
+            chunk = []
+            logger.info(f"{label}: {inserted}/{total}")
+    if chunk:
+        conn.executemany(sql, chunk)
+    conn.commit()
+
+
+def generate_dataset(args):
+    """Заполняет базу синтетическими пользователями, подписками и запросами"""
+    started = time.monotonic()
+    now = datetime.now()
+    random.seed(args.seed)
+
+    conn = sqlite3.connect(bot.DB_NAME)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+
+    # Индексы строятся после загрузки: так быстрее, а определения берутся из схемы бота
+    indexes = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+    ).fetchall()
+    for name, _ in indexes:
+        conn.execute(f'DROP INDEX {name}')
+
+    registered = {}
+
+    def users():
+        for index in range(args.users):
+            date = now - timedelta(days=random.uniform(0, 365))
+            registered[index] = date
+            yield (user_id_at(index), f'user{index}', f'Имя{index}', None, date.isoformat())
+
+    insert_chunks(conn, '''
+    INSERT INTO users (user_id, username, first_name, last_name, registration_date)
+    VALUES (?, ?, ?, ?, ?)
+    ''', users(), args.users, 'users')
+
+    def subscriptions():
+        for index in range(args.users):
+            user_id = user_id_at(index)
+            date = registered[index]
+            # Бесплатная подписка, как в register_user
+            yield (user_id, 'free', date.isoformat(), (date + timedelta(days=365)).isoformat())
+            if random.random() < args.premium_share:
+                # История продлений: последний период еще действует или уже истек
+                end = now + timedelta(days=random.uniform(-60, 30))
+                for _ in range(random.randint(1, 6)):
+                    start = end - PREMIUM_PERIOD
+                    yield (user_id, 'premium', start.isoformat(), end.isoformat())
+                    end = start - timedelta(days=random.uniform(0, 60))
+
+    insert_chunks(conn, '''
+    INSERT INTO subscriptions (user_id, subscription_type, start_date, end_date)
+    VALUES (?, ?, ?, ?)
+    ''', subscriptions(), args.users, 'subscriptions')
+    registered.clear()
+
+    def requests():
+        for _ in range(args.requests):
+            date = now - timedelta(days=random.uniform(0, args.days))
+            yield (pick_user(args.users), date.isoformat(), REQUEST_TYPE)
+
+    insert_chunks(conn, '''
+    INSERT INTO requests (user_id, request_date, request_type)
+    VALUES (?, ?, ?)
+    ''', requests(), args.requests, 'requests')
+
+    for name, sql in indexes:
+        logger.info(f"Создаю индекс {name}")
+        conn.execute(sql)
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+    return time.monotonic() - started
+
+
+def describe_dataset():
+    """Объем данных и схема базы"""
+    conn = sqlite3.connect(bot.DB_NAME)
+    counts = {
+        table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        for table in ('users', 'subscriptions', 'requests', 'requests_archive')
+    }
+    schema_version = conn.execute('PRAGMA user_version').fetchone()[0]
+    indexes = [row[0] for row in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL ORDER BY name")]
+    conn.close()
+    return {
+        'rows': counts,
+        'schema_version': schema_version,
+        'indexes': indexes,
+        'size_mb': round(os.path.getsize(bot.DB_NAME) / (1024 * 1024), 1)
+    }
+
+
+class StatementTracer:
+    """Запоминает SQL-запросы, выполненные через bot.get_db_connection"""
+
+    def __init__(self):
+        self.statements = None
+        self.original = bot.get_db_connection
+
+    def __enter__(self):
+        self.statements = []
+
+        def get_db_connection():
+            conn = self.original()
+            conn.set_trace_callback(self.statements.append)
+            return conn
+
+        bot.get_db_connection = get_db_connection
+        return self
+
+    def __exit__(self, *exc_info):
+        bot.get_db_connection = self.original
+
+
+def explain(statements):
+    """EXPLAIN QUERY PLAN для каждого уникального запроса функции"""
+    conn = sqlite3.connect(bot.DB_NAME)
+    plans = []
+    seen = set()
+    for sql in statements:
+        command = sql.lstrip().split(None, 1)[0].upper()
+        if command not in ('SELECT', 'INSERT', 'UPDATE', 'DELETE') or sql in seen:
+            continue
+        seen.add(sql)
+        try:
+            plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+        except sqlite3.Error as e:
+            plan = [f'ошибка: {e}']
+        plans.append({
+            'sql': ' '.join(sql.split()),
+            'plan': plan,
+            # Полный проход по таблице без индекса - главный кандидат на оптимизацию
+            'full_scans': [step for step in plan if step.startswith('SCAN') and 'INDEX' not in step]
+        })
+    conn.close()
+    return plans
+
+
+def make_operations(args):
+    """Замеряемые функции: имя -> (вызов, число повторов в однопоточном замере)"""
+    conn = sqlite3.connect(bot.DB_NAME)
+    last_user_id = conn.execute('SELECT MAX(user_id) FROM users').fetchone()[0] or FIRST_USER_ID
+    conn.close()
+    new_user_ids = iter(range(last_user_id + 1, 10 ** 12))
+    heavy = max(3, args.iterations // 50)
+
+    return {
+        'get_today_requests_count': (lambda: bot.get_today_requests_count(pick_user(args.users)), args.iterations),
+        'get_request_quota': (lambda: bot.get_request_quota(pick_user(args.users)), args.iterations),
+        'get_user_subscription': (lambda: bot.get_user_subscription(pick_user(args.users)), args.iterations),
+        'register_user:existing': (
+            lambda: bot.register_user(pick_user(args.users), 'user', 'Имя', None), args.iterations),
+        'register_user:new': (
+            lambda: bot.register_user(next(new_user_ids), 'new', 'Имя', None), args.iterations),
+        'log_request': (lambda: bot.log_request(pick_user(args.users), REQUEST_TYPE), args.iterations),
+        'get_bot_stats': (bot.get_bot_stats, heavy),
+        'broadcast:get_all_user_ids': (bot.get_all_user_ids, heavy)
+    }
+
+
+def run_single(operations):
+    """Каждая функция по очереди в одном потоке; план берется с первого вызова"""
+    timings = {}
+    plans = {}
+    for name, (call, iterations) in operations.items():
+        with StatementTracer() as tracer:
+            call()
+        plans[name] = explain(tracer.statements)
+
+        durations = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            call()
+            durations.append(time.perf_counter() - started)
+        timings[name] = summarize(durations)
+        logger.info(f"{name}: p50 {timings[name]['p50_ms']} мс")
+    return timings, plans
+
+
+def run_concurrent(operations, args):
+    """Потоки выполняют сценарий сообщения пользователя, как обработчики бота в пуле потоков"""
+    # Доли операций примерно как в боте: проверки лимита и подписки на каждое
+    # сообщение, запись запроса после анализа, регистрация на /start
+    scenario = [
+        ('get_request_quota', 4),
+        ('get_user_subscription', 4),
+        ('get_today_requests_count', 2),
+        ('log_request', 2),
+        ('register_user:existing', 1),
+        ('register_user:new', 1)
+    ]
+    names = [name for name, weight in scenario for _ in range(weight)]
+
+    durations = {name: [] for name, _ in scenario}
+    errors = {'locked': 0, 'other': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    def worker():
+        while time.monotonic() < deadline:
+            name = random.choice(names)
+            started = time.perf_counter()
+            try:
+                operations[name][0]()
+            except sqlite3.OperationalError as e:
+                with lock:
+                    errors['locked' if 'locked' in str(e) else 'other'] += 1
+                continue
+            except Exception:
+                with lock:
+                    errors['other'] += 1
+                continue
+            elapsed = time.perf_counter() - started
+            with lock:
+                durations[name].append(elapsed)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    total = sum(len(values) for values in durations.values())
+    return {
+        'threads': args.threads,
+        'duration_s': round(elapsed, 1),
+        'ops_per_s': round(total / elapsed, 1) if elapsed else 0.0,
+        'operations': {name: summarize(values) for name, values in durations.items()},
+        'sqlite_lock_errors': errors['locked'],
+        'other_errors': errors['other']
+    }
+
+
+def print_report(report):
+    """Печатает отчет в читаемом виде"""
+    dataset = report['dataset']
+    print(f"База: {report['database']} ({dataset['size_mb']} МБ, схема v{dataset['schema_version']})")
+    print("Строк: " + ", ".join(f"{table} {count}" for table, count in dataset['rows'].items()))
+
+    print("\nОдин поток:")
+    print(f"{'функция':<30}{'N':>7}{'p50, мс':>11}{'p95, мс':>11}{'p99, мс':>11}{'max, мс':>11}")
+    for name, stats in report['single'].items():
+        print(f"{name:<30}{stats['count']:>7}{stats['p50_ms']:>11}{stats['p95_ms']:>11}"
+              f"{stats['p99_ms']:>11}{stats['max_ms']:>11}")
+
+    concurrent = report['concurrent']
+    if concurrent:
+        print(f"\nПараллельно: {concurrent['threads']} потоков, {concurrent['ops_per_s']} операций/с, "
+              f"'database is locked': {concurrent['sqlite_lock_errors']}, "
+              f"других ошибок: {concurrent['other_errors']}")
+        for name, stats in concurrent['operations'].items():
+            print(f"{name:<30}{stats['count']:>7}{stats['p50_ms']:>11}{stats['p95_ms']:>11}"
+                  f"{stats['p99_ms']:>11}{stats['max_ms']:>11}")
+
+    print("\nПланы запросов:")
+    for name, plans in report['plans'].items():
+        for plan in plans:
+            marker = '⚠️ ' if plan['full_scans'] else ''
+            print(f"{marker}{name}: {plan['sql'][:100]}")
+            for step in plan['plan']:
+                print(f"    {step}")
+
+
+def print_comparison(report, baseline):
+    """Сравнивает p50/p95 однопоточного замера с прошлым отчетом"""
+    print(f"\nСравнение с отчетом от {baseline.get('created', '?')}:")
+    print(f"{'функция':<30}{'p50 было':>11}{'p50 стало':>11}{'p95 было':>11}{'p95 стало':>11}")
+    for name, stats in report['single'].items():
+        before = baseline.get('single', {}).get(name)
+        if before is None:
+            continue
+        print(f"{name:<30}{before['p50_ms']:>11}{stats['p50_ms']:>11}{before['p95_ms']:>11}{stats['p95_ms']:>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест функций базы данных бота')
+    parser.add_argument('--db', default=os.path.join(tempfile.gettempdir(), 'db_benchmark.db'),
+                        help='файл базы; существующая база используется повторно')
+    parser.add_argument('--regenerate', action='store_true', help='пересоздать данные в базе')
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--requests', type=int, default=20_000_000)
+    parser.add_argument('--days', type=int, default=bot.REQUESTS_RETENTION_DAYS,
+                        help='за сколько дней хранятся запросы')
+    parser.add_argument('--premium-share', type=float, default=0.1, help='доля пользователей с историей премиум')
+    parser.add_argument('--iterations', type=int, default=500, help='повторов каждой функции в одном потоке')
+    parser.add_argument('--threads', type=int, default=8, help='потоков в параллельном замере (0 - пропустить)')
+    parser.add_argument('--duration', type=float, default=20.0, help='длительность параллельного замера, с')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='сохранить отчет в JSON-файл')
+    parser.add_argument('--compare', help='прошлый JSON-отчет для сравнения')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO)
+    # Логи бота о каждой операции не нужны
+    logging.getLogger('bot').setLevel(logging.WARNING)
+
+    if args.regenerate and os.path.exists(args.db):
+        os.remove(args.db)
+    exists = os.path.exists(args.db)
+
+    bot.DB_NAME = args.db
+    bot.init_db()
+    generation_seconds = None
+    if not exists:
+        generation_seconds = round(generate_dataset(args), 1)
+
+    operations = make_operations(args)
+    single, plans = run_single(operations)
+    concurrent = run_concurrent(operations, args) if args.threads else None
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'database': args.db,
+        'dataset': dict(describe_dataset(), generation_s=generation_seconds),
+        'single': single,
+        'concurrent': concurrent,
+        'plans': plans
+    }
+    print_report(report)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            print_comparison(report, json.load(file))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,356 @@
+"""Нагрузочный тест обработчиков бота без доступа к Telegram и videohunt.ai.
+
+Синтетические Update прогоняются через настоящее Application и обработчики
+из bot.py. Bot API отвечает локальная заглушка, браузер заменен задержкой.
+База данных - временный файл.
+
+Пример:
+    python loadtest.py --users 2000 --concurrency 300 --json report.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+# Токен нужен только для сборки приложения, запросы в сеть не уходят
+os.environ.setdefault('TELEGRAM_TOKEN', '123456:LOADTEST')
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+import bot
+
+logger = logging.getLogger('loadtest')
+
+BOT_USER = {
+    'id': 123456,
+    'is_bot': True,
+    'first_name': 'LoadTest',
+    'username': 'loadtest_bot',
+    'can_join_groups': True,
+    'can_read_all_group_messages': False,
+    'supports_inline_queries': False
+}
+
+
+def summarize(values):
+    """Сводка по выборке длительностей в миллисекундах"""
+    return {
+        'count': len(values),
+        'p50_ms': round(bot.percentile(values, 50) * 1000, 2),
+        'p99_ms': round(bot.percentile(values, 99) * 1000, 2),
+        'max_ms': round(max(values) * 1000, 2) if values else 0.0
+    }
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Транспорт Bot API, который отвечает локально с заданной задержкой"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+        self.message_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        parameters = request_data.parameters if request_data else {}
+        if api_method == 'getMe':
+            result = BOT_USER
+        elif api_method in ('sendMessage', 'editMessageText', 'sendInvoice', 'sendDocument'):
+            chat_id = parameters.get('chat_id', 0)
+            result = {
+                'message_id': parameters.get('message_id') or next(self.message_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': parameters.get('text', '')
+            }
+        else:
+            result = True
+
+        return 200, json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+
+class UpdateFactory:
+    """Собирает синтетические Update от имени пользователей"""
+
+    def __init__(self, bot_instance):
+        self.bot = bot_instance
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+
+    def message(self, user_id, text=None, **extra):
+        user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+        message = {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': user
+        }
+        if text is not None:
+            message['text'] = text
+            if text.startswith('/'):
+                command = text.split()[0]
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        message.update(extra)
+        return Update.de_json({'update_id': next(self.update_ids), 'message': message}, self.bot)
+
+    def payment(self, user_id, amount):
+        return self.message(user_id, successful_payment={
+            'currency': 'XTR',
+            'total_amount': amount,
+            'invoice_payload': f'subscription_{user_id}',
+            'telegram_payment_charge_id': f'charge_{user_id}',
+            'provider_payment_charge_id': f'provider_{user_id}'
+        })
+
+
+class LoopLagSampler:
+    """Замеряет запаздывание цикла событий относительно ожидаемого пробуждения"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.samples = []
+        self.task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+
+class LockErrorCounter(logging.Handler):
+    """Считает сообщения лога о блокировке SQLite"""
+
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def emit(self, record):
+        if 'database is locked' in record.getMessage():
+            self.count += 1
+
+
+def get_rss_mb():
+    """Резидентная память процесса в мегабайтах, если доступна"""
+    psutil = bot.load_psutil()
+    if psutil is None:
+        return None
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+
+def make_fake_browser(duration, failure_rate):
+    """Заглушка process_video_with_selenium: только задержка, без Chrome"""
+    def process_video_with_selenium(video_url, prompts, owner=None, on_stage=None, session=None):
+        if session is None:
+            if on_stage:
+                on_stage('login')
+            time.sleep(duration * random.uniform(0.5, 1.5))
+        results = []
+        for number, prompt in enumerate(prompts, start=1):
+            if on_stage:
+                on_stage('analyzing', number, len(prompts))
+            success = random.random() >= failure_rate
+            results.append({
+                'prompt': prompt,
+                'success': success,
+                'results_page': f'https://videohunt.ai/moments/{owner}-{number}' if success else None,
+                'cause': None if success else 'result_timeout'
+            })
+        if not any(result['success'] for result in results):
+            return {'success': False, 'error': 'Ошибка обработки видео', 'cause': 'result_timeout'}
+        return {
+            'success': True,
+            'results': results,
+            'login_credentials': {'email': 'loadtest@example.com', 'password': 'loadtest'}
+        }
+    return process_video_with_selenium
+
+
+def make_fake_preload(duration):
+    """Заглушка preload_video_page: вход и загрузка страницы занимают часть анализа"""
+    def preload_video_page(owner, video_url):
+        started = time.monotonic()
+        time.sleep(duration * random.uniform(0.5, 1.5))
+        return {'id': None, 'preload_seconds': time.monotonic() - started}
+    return preload_video_page
+
+
+async def run_user(application, factory, user_id, args, latencies, errors):
+    """Сценарий одного пользователя: /start, /video, ссылка, промт, иногда /buy и оплата"""
+    steps = [
+        ('start', factory.message(user_id, '/start')),
+        ('video_command', factory.message(user_id, '/video')),
+        ('handle_message:url', factory.message(user_id, f'https://www.youtube.com/watch?v=load{user_id}')),
+        ('handle_message:prompt', factory.message(user_id, 'Где в видео говорят о ценах?'))
+    ]
+    if random.random() < args.premium_share:
+        steps.append(('buy_subscription', factory.message(user_id, '/buy')))
+        steps.append(('successful_payment', factory.payment(user_id, 100)))
+
+    for name, update in steps:
+        started = time.perf_counter()
+        try:
+            await application.process_update(update)
+        except Exception as e:
+            errors.append(f'{name}: {e}')
+        latencies.setdefault(name, []).append(time.perf_counter() - started)
+        if args.think_time:
+            await asyncio.sleep(random.uniform(0, args.think_time))
+
+
+async def run_load_test(args):
+    """Прогоняет сценарии пользователей и возвращает отчет"""
+    workdir = tempfile.mkdtemp(prefix='loadtest_')
+    bot.DB_NAME = os.path.join(workdir, 'loadtest.db')
+    bot.init_db()
+    bot.process_video_with_selenium = make_fake_browser(args.browser_time, args.failure_rate)
+    bot.preload_video_page = make_fake_preload(args.browser_time)
+
+    lock_errors = LockErrorCounter()
+    logging.getLogger().addHandler(lock_errors)
+
+    errors = []
+
+    async def on_error(update, context):
+        errors.append(str(context.error))
+        if isinstance(context.error, sqlite3.OperationalError) and 'locked' in str(context.error):
+            lock_errors.count += 1
+
+    request = FakeTelegramRequest(args.api_latency)
+    builder = (
+        Application.builder()
+        .token(os.environ['TELEGRAM_TOKEN'])
+        .request(request)
+        .get_updates_request(FakeTelegramRequest())
+    )
+    application = bot.build_application(builder)
+    application.add_error_handler(on_error)
+    await application.initialize()
+
+    factory = UpdateFactory(application.bot)
+    sampler = LoopLagSampler()
+    latencies = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def limited(user_id):
+        async with semaphore:
+            await run_user(application, factory, user_id, args, latencies, errors)
+
+    tracemalloc.start()
+    rss_before = get_rss_mb()
+    heap_before = tracemalloc.get_traced_memory()[0]
+
+    sampler.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(limited(10_000_000 + index) for index in range(args.users)))
+
+    # Задачи анализа запускаются обработчиками в фоне - дожидаемся их
+    current = asyncio.current_task()
+    pending = [task for task in asyncio.all_tasks() if task is not current and task is not sampler.task]
+    if pending:
+        await asyncio.wait(pending, timeout=args.drain_timeout)
+    elapsed = time.perf_counter() - started
+    await sampler.stop()
+
+    heap_after, heap_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = get_rss_mb()
+
+    await application.shutdown()
+    logging.getLogger().removeHandler(lock_errors)
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        'users': args.users,
+        'concurrency': args.concurrency,
+        'duration_s': round(elapsed, 2),
+        'updates_per_s': round(len(all_latencies) / elapsed, 1) if elapsed else 0.0,
+        'handlers': {name: summarize(values) for name, values in sorted(latencies.items())},
+        'all_handlers': summarize(all_latencies),
+        'loop_lag': summarize(sampler.samples),
+        'sqlite_lock_errors': lock_errors.count,
+        'errors': len(errors),
+        'error_samples': errors[:10],
+        'api_calls': request.calls,
+        'memory': {
+            'heap_growth_mb': round((heap_after - heap_before) / (1024 * 1024), 2),
+            'heap_peak_mb': round(heap_peak / (1024 * 1024), 2),
+            'rss_before_mb': round(rss_before, 1) if rss_before is not None else None,
+            'rss_after_mb': round(rss_after, 1) if rss_after is not None else None
+        },
+        'database': bot.DB_NAME
+    }
+
+
+def print_report(report):
+    """Печатает отчет в читаемом виде"""
+    print(f"Пользователей: {report['users']}, параллельно: {report['concurrency']}, "
+          f"время: {report['duration_s']} с, обновлений/с: {report['updates_per_s']}")
+    print(f"{'обработчик':<28}{'N':>8}{'p50, мс':>12}{'p99, мс':>12}{'max, мс':>12}")
+    rows = list(report['handlers'].items()) + [('ВСЕ', report['all_handlers']), ('лаг цикла событий', report['loop_lag'])]
+    for name, stats in rows:
+        print(f"{name:<28}{stats['count']:>8}{stats['p50_ms']:>12}{stats['p99_ms']:>12}{stats['max_ms']:>12}")
+    print(f"Ошибок 'database is locked': {report['sqlite_lock_errors']}, всего ошибок: {report['errors']}")
+    memory = report['memory']
+    print(f"Память: прирост кучи {memory['heap_growth_mb']} МБ, пик {memory['heap_peak_mb']} МБ, "
+          f"RSS {memory['rss_before_mb']} -> {memory['rss_after_mb']} МБ")
+    print(f"Вызовы Bot API: {report['api_calls']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест обработчиков бота")
+    parser.add_argument('--users', type=int, default=1000, help="число симулируемых пользователей")
+    parser.add_argument('--concurrency', type=int, default=200, help="сколько пользователей активны одновременно")
+    parser.add_argument('--api-latency', type=float, default=0.02, help="задержка ответа Bot API, с")
+    parser.add_argument('--browser-time', type=float, default=0.5, help="средняя длительность анализа видео, с")
+    parser.add_argument('--failure-rate', type=float, default=0.05, help="доля неудачных анализов")
+    parser.add_argument('--premium-share', type=float, default=0.1, help="доля пользователей, покупающих подписку")
+    parser.add_argument('--think-time', type=float, default=0.0, help="пауза пользователя между шагами, с")
+    parser.add_argument('--drain-timeout', type=float, default=300.0, help="сколько ждать фоновые задачи, с")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', help="сохранить отчет в JSON-файл")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    report = asyncio.run(run_load_test(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()